@@ -0,0 +1,40 @@
+"""add device releases table
+
+Revision ID: 5b2e9d1c7a43
+Revises: c906c4a3f534
+Create Date: 2026-10-17 09:14:32.218305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e9d1c7a43'
+down_revision = 'c906c4a3f534'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'device_releases',
+        sa.Column('id', sa.Integer, primary_key=True, comment='Generated release record ID'),
+        sa.Column('device_id', sa.Integer, sa.ForeignKey('devices.id', ondelete='CASCADE'), nullable=False, unique=True, comment='Device the release was looked up for'),
+        sa.Column('version', sa.String(80), comment='Latest version available from the vendor (empty if none was found)'),
+        sa.Column('download_url', sa.String(1024), comment='Firmware download address'),
+        sa.Column('docs_url', sa.String(1024), comment='Release notes or documentation address'),
+        sa.Column('notes', sa.String(1024), comment='Additional release notes'),
+        sa.Column('hash_type', sa.String(30), comment='Hash algorithm of hash_sum'),
+        sa.Column('hash_sum', sa.String(255), comment='Hash of the firmware download'),
+        sa.Column('file_size', sa.String(30), comment='Firmware download size as published by the vendor'),
+        sa.Column('release_date', sa.String(50), comment='Release date as published by the vendor'),
+        sa.Column('source_etag', sa.String(255), comment='ETag of the vendor data the release was read from'),
+        sa.Column('checked_at', sa.DateTime, nullable=False, comment='Time (UTC) the vendor was last checked')
+    )
+    op.create_index('ix_device_releases_checked_at', 'device_releases', ['checked_at'])
+
+
+def downgrade():
+    op.drop_index('ix_device_releases_checked_at', 'device_releases')
+    op.drop_table('device_releases')
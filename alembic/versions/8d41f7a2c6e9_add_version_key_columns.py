@@ -0,0 +1,42 @@
+"""add version key columns
+
+Revision ID: 8d41f7a2c6e9
+Revises: 5b2e9d1c7a43
+Create Date: 2026-10-17 19:20:41.532871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from utils.version import version_key
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41f7a2c6e9'
+down_revision = '5b2e9d1c7a43'
+branch_labels = None
+depends_on = None
+
+tables = ['devices', 'device_releases']
+
+
+def upgrade():
+    connection = op.get_bind()
+    for table_name in tables:
+        op.add_column(table_name, sa.Column('version_key', sa.String(160), comment='Sortable form of version (see utils.version), maintained with version'))
+        op.create_index('ix_{}_version_key'.format(table_name), table_name, ['version_key'])
+
+        # Backfill the keys of existing rows
+        table = sa.table(table_name, sa.column('id', sa.Integer), sa.column('version', sa.String), sa.column('version_key', sa.String))
+        rows = connection.execute(sa.select([table.c.id, table.c.version]).where(table.c.version.isnot(None))).fetchall()
+        if rows:
+            connection.execute(table.update().where(table.c.id == sa.bindparam('row_id')).values(version_key=sa.bindparam('key')),
+                [{'row_id': row_id, 'key': version_key(version)} for row_id, version in rows])
+
+
+def downgrade():
+    for table_name in tables:
+        op.drop_index('ix_{}_version_key'.format(table_name), table_name)
+        # Use batch operation for drop column as SQLite does not natively support it
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('version_key')
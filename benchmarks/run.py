@@ -0,0 +1,301 @@
+"""Benchmarks for the vendor checks, run entirely against the local fixture server
+
+Usage: python benchmarks/run.py [--sizes 10,1000,10000] [--rounds 20] [--output bench_output.txt]
+
+Reports per-phase timings (fetch, parse, compare) of the vendor hot paths, the end to end
+throughput of checking inventories of the given sizes and the time to discover stand-in devices.
+"""
+
+import argparse
+from functools import cmp_to_key
+import ipaddress
+import os.path
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from cmp_version import cmp_version
+from tabulate import tabulate
+
+from benchmarks.server import DeviceServer, FixtureServer
+from discovery import Discoverer
+from inventory import Device, submit_checks
+from utils import http
+from utils.concurrency import KeyedExecutor
+from utils.http import HttpClient, get_response_expiry
+from utils.version import version_key
+from vendor import Release, registry
+
+CABLE_MODEMS = ['CM500', 'CM600', 'CM700', 'CM1000', 'C3700', 'C6220', 'C6300', 'C7000', 'C7800', 'N450']
+PROVIDERS = ['Comcast', 'Spectrum', 'Cox', 'Other']
+
+
+class BenchConfig:
+    """Stand-in for the homenet Config with caching suited to repeatable measurements"""
+    workers = 8
+    vendor_workers = 4
+    http_timeout = 30
+    http_retries = 0
+    http_cache = False
+    host_connections = 8
+    release_cache_ttl = 3600
+    release_cache_size = 100000
+    release_cache_persist = False
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+
+def timed(function, rounds):
+    """Run function rounds times, returning (total seconds, last result)"""
+    result = None
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = function()
+    return time.perf_counter() - start, result
+
+
+def row(phase, case, rounds, seconds, size=None):
+    return {
+        'phase': phase,
+        'case': case,
+        'ops': rounds,
+        'total (s)': round(seconds, 4),
+        'per op (ms)': round(seconds * 1000 / rounds, 3),
+        'ops/s': round(rounds / seconds, 1) if seconds else None,
+        'bytes/op': size,
+    }
+
+
+def full_tree_product_page(content):
+    """Previous Netgear product page extraction, building the complete BeautifulSoup tree; kept as the baseline"""
+    netgear = registry.get('netgear')
+    soup = BeautifulSoup(content, "lxml")
+    latest_releases = soup.find(id='topicsdownload').find(class_='latest-version').find_all("a", string=re.compile('^Release Notes'))
+    versions = {}
+    for link in latest_releases:
+        release = link.parent.parent
+        title = release.find(re.compile("^h")).string
+        version = netgear._normalize_release(title)
+        if not version:
+            continue
+        download_link = release.find("a", class_="btn")['href']
+        file_size = None
+        size_match = re.search(r'File\ssize:\s([0-9.]+\s*[A-Za-z]+)', release.get_text())
+        if size_match:
+            file_size = size_match.group(1)
+        versions[version] = {'download': download_link, 'docs': link['href'], 'size': file_size}
+    return versions
+
+
+def chunked(content, size=64 * 1024):
+    """Split a body the way a response is read"""
+    return [content[i:i + size] for i in range(0, len(content), size)]
+
+
+def bench_fetch(server, rounds):
+    client = HttpClient(host_connections=8, retries=0)
+    pages = [
+        ('netgear product page', server.product_url.format('R7000')),
+        ('netgear cable modem KB', server.cable_modem_url),
+        ('openwrt download index', '{}/openwrt/releases/19.07.2/targets/ath79/generic/'.format(server.base_url)),
+        ('openwrt ToH dump', server.database_url),
+    ]
+    results = []
+    for name, url in pages:
+        seconds, response = timed(lambda: client.get(url), rounds)
+        results.append(row('fetch', name, rounds, seconds, len(response.content)))
+    client.close()
+    return results
+
+
+def bench_parse(server, config, rounds):
+    netgear = registry.get('netgear')
+    openwrt = registry.get('openwrt')
+    product_page = server.product_page('R7000').encode('utf-8')
+    cable_modem_page = server.cable_modem_page().encode('utf-8')
+    target = 'ath79/generic'
+    index_page = server.index_page(target).encode('utf-8')
+    filename = server.targets[target][0]
+
+    results = []
+    baseline_seconds, expected = timed(lambda: full_tree_product_page(product_page), rounds)
+    results.append(row('parse', 'netgear product page, full tree (baseline)', rounds, baseline_seconds, len(product_page)))
+    seconds, versions = timed(lambda: netgear._parse_product_page(chunked(product_page)), rounds)
+    if versions != expected:
+        raise AssertionError('Netgear product page extraction differs from the baseline: {} != {}'.format(versions, expected))
+    results.append(row('parse', 'netgear product page, {:.1f}x baseline'.format(baseline_seconds / seconds), rounds, seconds, len(product_page)))
+
+    def cable_modem():
+        soup = BeautifulSoup(cable_modem_page, "lxml")
+        return netgear._cable_modem_version(soup, 'C6300', 'Comcast')
+    seconds, _ = timed(cable_modem, rounds)
+    results.append(row('parse', 'netgear cable modem KB', rounds, seconds, len(cable_modem_page)))
+
+    seconds, (_, files) = timed(lambda: openwrt._parse_index_page(BeautifulSoup(index_page, "lxml")), rounds)
+    if filename not in files:
+        raise AssertionError('{} not found in the OpenWRT download index'.format(filename))
+    results.append(row('parse', 'openwrt download index', rounds, seconds, len(index_page)))
+
+    # Download the dump once, then time rebuilding the model index from it
+    openwrt._get_index()
+    build_rounds = max(1, rounds // 10)
+    seconds, _ = timed(lambda: openwrt._build_index(openwrt._source_signature()), build_rounds)
+    results.append(row('parse', 'openwrt ToH index build ({} rows)'.format(len(server.models)), build_rounds, seconds, len(server.dump)))
+
+    # Uncached get_latest: index freshness check and model lookup, download index page already parsed
+    device = Device(id=1, vendor_id='openwrt', model=server.models[len(server.models) // 2], version='1.0')
+    get_latest = type(openwrt).get_latest.__wrapped__
+    get_latest(openwrt, device)
+    lookup_rounds = rounds * 10
+    seconds, _ = timed(lambda: get_latest(openwrt, device), lookup_rounds)
+    results.append(row('parse', 'openwrt ToH model lookup', lookup_rounds, seconds))
+    return results
+
+
+def bench_compare(rounds):
+    generator = random.Random(1)
+    versions = ['{}.{}.{}.{}'.format(generator.randint(1, 3), generator.randint(0, 20), generator.randint(0, 20), generator.randint(0, 200))
+        for _ in range(1000)]
+    devices = [Device(id=i, vendor_id='netgear', model='R7000', version=version) for i, version in enumerate(versions)]
+    release = Release(version='2.10.10.100')
+    headers = [
+        {'Cache-Control': 'public, max-age=3600', 'Date': 'Sat, 17 Oct 2026 10:00:00 GMT'},
+        {'Expires': 'Sat, 17 Oct 2026 11:00:00 GMT'},
+        {'Cache-Control': 'no-cache'},
+    ]
+
+    results = []
+    seconds, _ = timed(lambda: [device.is_outdated_by(release) for device in devices], rounds)
+    results.append(row('compare', 'device version vs release', rounds * len(devices), seconds))
+    seconds, _ = timed(lambda: sorted(versions[:20], key=cmp_to_key(cmp_version), reverse=True), rounds * 10)
+    results.append(row('compare', 'sort of 20 versions with cmp_version', rounds * 10, seconds))
+    seconds, _ = timed(lambda: max(versions[:20], key=version_key), rounds * 10)
+    results.append(row('compare', 'netgear latest of 20 versions', rounds * 10, seconds))
+    seconds, _ = timed(lambda: [get_response_expiry(h) for h in headers], rounds * 100)
+    results.append(row('compare', 'get_response_expiry', rounds * 100 * len(headers), seconds))
+    return results
+
+
+def make_fleet(server, size, distinct):
+    """Inventory of size devices, mixing vendors, with at most distinct models per kind of device"""
+    generator = random.Random(size)
+    openwrt_models = generator.sample(server.models, min(distinct, len(server.models)))
+    netgear_models = ['R{}'.format(6000 + n) for n in range(distinct)]
+    cable_models = ['{} [{}]'.format(model, provider) for model in CABLE_MODEMS for provider in PROVIDERS][:distinct]
+    devices = []
+    for device_id in range(1, size + 1):
+        kind = generator.random()
+        if kind < 0.5:
+            devices.append(Device(id=device_id, vendor_id='openwrt', model=generator.choice(openwrt_models), version='18.06.8'))
+        elif kind < 0.85:
+            devices.append(Device(id=device_id, vendor_id='netgear', model=generator.choice(netgear_models), version='1.0.9.88'))
+        else:
+            devices.append(Device(id=device_id, vendor_id='netgear', model=generator.choice(cable_models), version='V1.02.01'))
+    return devices
+
+
+def check_fleet(devices, config):
+    """Check all devices the way the query command does, returning the number of failed checks"""
+    failed = 0
+    with KeyedExecutor(config.workers, config.vendor_workers) as executor:
+        for device, check in zip(devices, submit_checks(executor, devices)):
+            try:
+                device.is_outdated_by(check.result())
+            except Exception:
+                failed += 1
+    return failed
+
+
+def bench_throughput(server, sizes, distinct, cache_dir):
+    results = []
+    for size in sizes:
+        devices = make_fleet(server, size, distinct)
+        config = BenchConfig(cache_dir)
+        # New vendor instances with empty release and page caches for every inventory size
+        registry.init_config(config)
+        requests_before = server.requests
+        start = time.perf_counter()
+        failed = check_fleet(devices, config)
+        seconds = time.perf_counter() - start
+        result = row('throughput', '{} devices'.format(size), size, seconds)
+        result['bytes/op'] = None
+        result['requests'] = server.requests - requests_before
+        result['failed'] = failed
+        results.append(result)
+    return results
+
+
+def bench_discovery(count):
+    """Discover count stand-in devices on loopback addresses 127.0.0.2 onwards, then read their versions"""
+    if not count:
+        return []
+    first = DeviceServer('netgear', 'R7000', 'V1.0.11.116', host='127.0.0.2').start()
+    servers = [first]
+    for n in range(1, count):
+        kind, model = ('netgear', 'R{}'.format(6000 + n)) if n % 2 == 0 else ('openwrt', None)
+        servers.append(DeviceServer(kind, model, '19.07.{}'.format(n % 10), host='127.0.0.{}'.format(n + 2), port=first.port).start())
+    try:
+        discoverer = Discoverer(concurrency=128, timeout=2)
+        network = '127.0.0.0/{}'.format(32 - (count + 2).bit_length())
+        start = time.perf_counter()
+        found = discoverer.discover(network, port=first.port)
+        seconds = time.perf_counter() - start
+        addresses = ipaddress.ip_network(network).num_addresses - 2
+        result = row('discovery', 'discover {} ({} devices)'.format(network, count), addresses, seconds)
+        result['failed'] = count - len(found)
+        results = [result]
+
+        devices = [Device(id=n, vendor_id=device['vendor_id'], model=device['model'] or 'unknown', address=device['address'])
+            for n, device in enumerate(found)]
+        start = time.perf_counter()
+        versions = discoverer.versions(devices)
+        result = row('discovery', 'refresh versions', len(devices), time.perf_counter() - start)
+        result['failed'] = len(devices) - len(versions)
+        results.append(result)
+        return results
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark vendor checks against local fixtures')
+    parser.add_argument('--sizes', default='10,1000,10000', help='Comma separated inventory sizes for the throughput benchmark')
+    parser.add_argument('--distinct', type=int, default=100, help='Maximum distinct models per kind of device in an inventory')
+    parser.add_argument('--rounds', type=int, default=20, help='Iterations for each fetch/parse measurement')
+    parser.add_argument('--dump-rows', type=int, default=20000, help='Rows in the synthetic OpenWRT ToH dump')
+    parser.add_argument('--devices', type=int, default=100, help='Stand-in devices for the discovery benchmark (at most 250, 0 to skip)')
+    parser.add_argument('--output', type=argparse.FileType('w'), help='Also write the report to this file')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    cache_dir = tempfile.mkdtemp(prefix='homenet-bench-')
+    config = BenchConfig(cache_dir)
+    http.configure(config)
+    with FixtureServer(dump_rows=args.dump_rows) as server:
+        registry.get_class('netgear').product_url = server.product_url
+        registry.get_class('netgear').cable_modem_url = server.cable_modem_url
+        registry.get_class('openwrt').database_url = server.database_url
+        registry.init_config(config)
+
+        results = bench_fetch(server, args.rounds)
+        results += bench_parse(server, config, args.rounds)
+        results += bench_compare(args.rounds)
+        results += bench_throughput(server, sizes, args.distinct, cache_dir)
+    results += bench_discovery(min(args.devices, 250))
+    registry.close()
+
+    report = tabulate(results, headers='keys')
+    print(report)
+    if args.output:
+        args.output.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
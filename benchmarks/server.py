@@ -0,0 +1,259 @@
+"""Local stand-ins for the vendor sites, serving the recorded pages in benchmarks/fixtures, and for devices
+
+The OpenWRT Table of Hardware dump is generated with a configurable number of rows, pointing its
+firmware upgrade URLs at download index pages served by the same server.
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import os.path
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__all__ = ['DeviceServer', 'FixtureServer', 'make_toh_dump']
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Subset of the columns of the real dump, in the same order
+TOH_COLUMNS = ['pid', 'devicetype', 'brand', 'model', 'version', 'fccid', 'availability', 'whereavailable',
+    'supportedsincecommit', 'supportedsincerel', 'supportedcurrentrel', 'unsupported_functions', 'target',
+    'subtarget', 'packagearchitecture', 'bootloader', 'cpu', 'cpucores', 'cpumhz', 'flashmb', 'rammb',
+    'ethernet100mports', 'ethernetgbitports', 'switch', 'vlan', 'modem', 'wlan24ghz', 'wlan50ghz',
+    'wlancomments', 'wlandriver', 'detachableantennas', 'bluetooth', 'usbports', 'sataports', 'serial',
+    'jtag', 'ledcount', 'buttoncount', 'gpios', 'powersupply', 'devicepage', 'firmwareopenwrtinstallurl',
+    'firmwareopenwrtupgradeurl', 'firmwareoemstockurl', 'comments']
+
+BRANDS = ['TP-Link', 'Netgear', 'Linksys', 'ASUS', 'D-Link', 'GL.iNet', 'Ubiquiti', 'Xiaomi', 'ZyXEL', 'Buffalo']
+TARGETS = ['{}/{}'.format(target, subtarget)
+    for target in ['ath79', 'ramips', 'ipq40xx', 'mvebu', 'bcm53xx', 'lantiq', 'x86', 'mediatek', 'ipq806x', 'kirkwood']
+    for subtarget in ['generic', 'nand', 'tiny', 'mt7621', 'mt76x8', 'cortexa9', 'xrx200', '64', 'mt7622', 'legacy']]
+
+
+def make_toh_dump(rows, base_url, seed=1):
+    """Build a gzipped, tab separated Table of Hardware dump
+
+    Returns the compressed bytes, the formatted model names (as used for OpenWRT devices) of the
+    supported devices and the image file names listed for each target.
+    """
+    generator = random.Random(seed)
+    models = []
+    targets = {target: [] for target in TARGETS}
+    text = io.StringIO()
+    writer = csv.writer(text, delimiter='\t', lineterminator='\n')
+    writer.writerow(TOH_COLUMNS)
+    for pid in range(rows):
+        brand = generator.choice(BRANDS)
+        model = 'Model {}'.format(pid)
+        version = generator.choice(['NULL', 'v1', 'v2', 'v3'])
+        supported = generator.random() > 0.1
+        release = generator.choice(['19.07.2', '19.07.1', '18.06.8']) if supported else '-'
+        target = generator.choice(TARGETS)
+        filename = 'openwrt-{}-{}-{}-squashfs-sysupgrade.bin'.format(
+            release, target.replace('/', '-'), '{}_{}'.format(brand, model).lower().replace(' ', '-'))
+        upgrade_url = '{}/openwrt/releases/19.07.2/targets/{}/{}'.format(base_url, target, filename) if supported else ''
+        if supported:
+            targets[target].append(filename)
+            models.append('{} {}{}'.format(brand, model, '' if version == 'NULL' else ' ' + version))
+        values = {column: 'NULL' for column in TOH_COLUMNS}
+        values.update({
+            'pid': pid, 'devicetype': 'WiFi Router', 'brand': brand, 'model': model, 'version': version,
+            'supportedcurrentrel': release, 'target': target.split('/')[0], 'subtarget': target.split('/')[1],
+            'cpu': 'QCA9558', 'cpumhz': 720, 'flashmb': 16, 'rammb': 128, 'firmwareopenwrtupgradeurl': upgrade_url,
+            'devicepage': 'https://openwrt.org/toh/{}/{}'.format(brand.lower(), model.lower().replace(' ', '_')),
+            'comments': 'Synthetic benchmark device',
+        })
+        writer.writerow([values[column] for column in TOH_COLUMNS])
+    return gzip.compress(text.getvalue().encode('utf-8')), models, targets
+
+
+def _read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r') as fixture:
+        return fixture.read()
+
+
+def _padding(kilobytes):
+    """Unrelated navigation markup to bring a recorded page up to the weight of the live page"""
+    item = '<li class="menu-item"><a href="/products/category-{0}/">Product category {0}</a><span class="description">Browse the category {0} product range</span></li>\n'
+    items = []
+    size = 0
+    while size < kilobytes * 1024:
+        items.append(item.format(len(items)))
+        size += len(items[-1])
+    return '<nav class="mega-menu"><ul>\n' + ''.join(items) + '</ul></nav>'
+
+
+class FixtureServer:
+    """Threaded HTTP server on localhost standing in for the Netgear and OpenWRT sites"""
+
+    def __init__(self, dump_rows=20000, page_padding_kb=200):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._httpd.daemon_threads = True
+        self.base_url = 'http://127.0.0.1:{}'.format(self._httpd.server_port)
+        self.dump, self.models, self.targets = make_toh_dump(dump_rows, self.base_url)
+        padding = _padding(page_padding_kb)
+        self._product_page = _read_fixture('netgear-product.html').replace('%PADDING%', padding)
+        self._cable_modem_page = _read_fixture('netgear-cable-modem-kb.html').replace('%PADDING%', padding)
+        self._index_page = _read_fixture('openwrt-index.html')
+        # openwrt.org answers conditional requests for the dump, so the stand-in does too
+        self.dump_etag = '"{}"'.format(hashlib.sha256(self.dump).hexdigest()[:16])
+        self.dump_last_modified = 'Sun, 29 Mar 2020 10:00:00 GMT'
+        self._thread = None
+        self.requests = 0
+
+    @property
+    def product_url(self):
+        return self.base_url + '/netgear/support/product/{}'
+
+    @property
+    def cable_modem_url(self):
+        return self.base_url + '/netgear/kb/cable-modem-firmware'
+
+    @property
+    def database_url(self):
+        return self.base_url + '/openwrt/toh_dump_tab_separated_csv.csv.gz'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def product_page(self, model):
+        return self._product_page.replace('%MODEL%', model)
+
+    def cable_modem_page(self):
+        return self._cable_modem_page
+
+    def index_page(self, target):
+        row = '<tr><td class="n"><a href="{0}">{0}</a></td><td class="sh">{1}</td><td class="s">5.7 MB</td><td class="d">Sun Mar 29 10:00:02 2020</td></tr>'
+        rows = '\n'.join(row.format(filename, hashlib.sha256(filename.encode('utf-8')).hexdigest()) for filename in self.targets.get(target, []))
+        return self._index_page.replace('%TARGET%', target).replace('%ROWS%', rows)
+
+    def _route(self, path):
+        """Return (content type, body) for the path or None if not found"""
+        path = urllib.parse.unquote(urllib.parse.urlsplit(path).path)
+        if path.startswith('/netgear/support/product/'):
+            return 'text/html; charset=utf-8', self.product_page(path[len('/netgear/support/product/'):]).encode('utf-8')
+        if path == '/netgear/kb/cable-modem-firmware':
+            return 'text/html; charset=utf-8', self.cable_modem_page().encode('utf-8')
+        if path == '/openwrt/toh_dump_tab_separated_csv.csv.gz':
+            return 'application/gzip', self.dump
+        prefix = '/openwrt/releases/19.07.2/targets/'
+        if path.startswith(prefix) and path.endswith('/'):
+            return 'text/html; charset=utf-8', self.index_page(path[len(prefix):-1]).encode('utf-8')
+        return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                route = server._route(self.path)
+                if route is None:
+                    self.send_error(404)
+                    return
+                content_type, body = route
+                if body is server.dump:
+                    if self.headers.get('If-None-Match') == server.dump_etag:
+                        self.send_response(304)
+                        self.send_header('ETag', server.dump_etag)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header('ETag', server.dump_etag)
+                    self.send_header('Last-Modified', server.dump_last_modified)
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# Management pages answered without logging in, as served by the devices
+NETGEAR_SETTINGS = 'Firmware={version}_10.2.100\r\nRegionTag={model}_NA\r\nRegion=us\r\nModel={model}\r\nInternetConnectionStatus=Up\r\nSOAPVersion=3.50\r\n'
+LUCI_LOGIN = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>OpenWrt - LuCI</title></head>
+<body><form method="post"><input name="luci_username" value="root"><input name="luci_password" type="password"></form>
+<footer><a href="https://github.com/openwrt/luci">Powered by LuCI openwrt-19.07 branch (git-20.057.55219-13dd17f)</a> / OpenWrt {version} r10947-65030d81f3</footer>
+</body></html>
+"""
+
+
+class DeviceServer:
+    """HTTP server standing in for the management pages of a Netgear (kind netgear) or OpenWRT (kind openwrt) device
+
+    Several devices can share a port on different loopback addresses (127.0.0.2, 127.0.0.3, ...),
+    which Linux routes to the local host without configuration.
+    """
+
+    def __init__(self, kind, model, version, host='127.0.0.1', port=0):
+        if kind == 'netgear':
+            self.pages = {'/currentsetting.htm': ('text/html', NETGEAR_SETTINGS.format(model=model, version=version))}
+        else:
+            self.pages = {'/cgi-bin/luci/': ('text/html; charset=utf-8', LUCI_LOGIN.format(version=version))}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self.address = '{}:{}'.format(host, self._httpd.server_port)
+        self.port = self._httpd.server_port
+        self.requests = 0
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                page = server.pages.get(urllib.parse.urlsplit(self.path).path)
+                if page is None:
+                    self.send_error(404)
+                    return
+                content_type, body = page
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
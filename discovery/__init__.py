@@ -0,0 +1,164 @@
+"""
+Probing of device management addresses to identify devices and read their current versions
+"""
+
+import asyncio
+import ipaddress
+import logging
+import ssl
+import urllib.parse
+
+from utils.metrics import metrics
+from vendor import registry
+
+__all__ = ['Discoverer', 'ProbeResponse', 'parse_address']
+
+logger = logging.getLogger('discovery')
+
+# Management pages are small, anything past this is not needed to identify the device
+MAX_RESPONSE = 256 * 1024
+
+
+class ProbeResponse:
+    """Status, headers (with lower case names) and body of a device's answer to a probe"""
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8', errors='replace')
+
+
+def parse_address(address):
+    """Split a device address (host, host:port or URL) into (host, port, tls)"""
+    if '//' not in address:
+        address = 'http://' + address
+    parts = urllib.parse.urlsplit(address)
+    tls = parts.scheme == 'https'
+    return parts.hostname, parts.port or (443 if tls else 80), tls
+
+
+def _address(host, port, tls):
+    # IPv6 hosts are bracketed, as in URLs, so their colons aren't taken for a port
+    address = str(host) if host.version == 4 else '[{}]'.format(host)
+    if port is not None:
+        address = '{}:{}'.format(address, port)
+    return 'https://' + address if tls else address
+
+
+class Discoverer:
+    """Probes many addresses concurrently with asyncio, with at most concurrency probes in flight
+
+    Each vendor with a probe_path is asked, through parse_probe, to recognize the response to a GET
+    of that path and extract the model and version. Requests are plain HTTP/1.0 with short
+    timeouts; certificates are not verified as devices mostly use self-signed ones.
+    """
+
+    def __init__(self, concurrency=128, timeout=2):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._ssl = ssl.create_default_context()
+        self._ssl.check_hostname = False
+        self._ssl.verify_mode = ssl.CERT_NONE
+
+    def discover(self, network, port=None, tls=False):
+        """Identify the devices in a network (CIDR notation), returning dicts of address, vendor_id, model and version
+
+        Addresses are probed on port (default 80, or 443 with tls) and only addresses answering are
+        probed for more than one vendor.
+        """
+        hosts = ipaddress.ip_network(network, strict=False).hosts()
+        vendors = [vendor for vendor in registry.values() if vendor is not None and vendor.probe_path]
+        addresses = (_address(host, port, tls) for host in hosts)
+        found = asyncio.run(self._map(lambda address: self._identify(address, vendors), addresses))
+        return sorted(found, key=lambda device: ipaddress.ip_address(parse_address(device['address'])[0]))
+
+    def versions(self, devices):
+        """Read the current version of devices with an address, returning a dict of device ID to version"""
+        async def probe(device):
+            vendor = registry.get(device.vendor_id)
+            if vendor is None or not vendor.probe_path or not device.address:
+                return None
+            return await self._read_version(device, vendor)
+        return dict(asyncio.run(self._map(probe, devices)))
+
+    async def _map(self, function, items):
+        """Await function(item) for all items, concurrency at a time, collecting results other than None"""
+        results = []
+        items = iter(items)
+
+        async def worker():
+            # Workers share the iterator, so addresses are only generated as they are probed
+            for item in items:
+                result = await function(item)
+                if result is not None:
+                    results.append(result)
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return results
+
+    async def _identify(self, address, vendors):
+        responses = {}
+        for vendor in vendors:
+            if vendor.probe_path not in responses:
+                responses[vendor.probe_path] = await self.fetch(address, vendor.probe_path)
+                if not any(responses.values()):
+                    # Nothing is listening, don't wait for the remaining paths to time out too
+                    return None
+            response = responses[vendor.probe_path]
+            identified = vendor.parse_probe(response) if response is not None else None
+            if identified:
+                model, version = identified
+                vendor_id = type(vendor).id()
+                metrics.inc('discovery_devices', vendor=vendor_id)
+                return {'address': address, 'vendor_id': vendor_id, 'model': model, 'version': version}
+        return None
+
+    async def _read_version(self, device, vendor):
+        response = await self.fetch(device.address, vendor.probe_path)
+        identified = vendor.parse_probe(response) if response is not None else None
+        if not identified or not identified[1]:
+            logger.warning('Failed to read the version of device %d at %s', device.id, device.address)
+            return None
+        return device.id, identified[1]
+
+    async def fetch(self, address, path):
+        """GET the path from the address, returning a ProbeResponse or None if there's no usable answer"""
+        with metrics.timer('discovery_probe'):
+            try:
+                # Addresses entered by hand may not parse
+                host, port, tls = parse_address(address)
+                return await asyncio.wait_for(self._get(host, port, tls, path), self.timeout)
+            except (OSError, asyncio.TimeoutError, ValueError) as e:
+                logger.debug('No response from %s%s: %r', address, path, e)
+                metrics.inc('discovery_unanswered')
+                return None
+
+    async def _get(self, host, port, tls, path):
+        reader, writer = await asyncio.open_connection(host, port, ssl=self._ssl if tls else None)
+        try:
+            request = 'GET {} HTTP/1.0\r\nHost: {}\r\nUser-Agent: homenet-check\r\nConnection: close\r\n\r\n'.format(path, host)
+            writer.write(request.encode('ascii'))
+            await writer.drain()
+            data = await reader.read(MAX_RESPONSE)
+            while len(data) < MAX_RESPONSE:
+                chunk = await reader.read(MAX_RESPONSE - len(data))
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            writer.close()
+        head, _, body = data.partition(b'\r\n\r\n')
+        lines = head.decode('iso-8859-1').split('\r\n')
+        status_line = lines[0].split()
+        # Closed connections and other services on the port don't answer with an HTTP status line
+        if len(status_line) < 2 or not status_line[0].startswith('HTTP/') or not status_line[1].isdigit():
+            raise ValueError('Not an HTTP response: {!r}'.format(lines[0][:80]))
+        status = int(status_line[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return ProbeResponse(status, headers, body)
@@ -1,16 +1,19 @@
 import argparse
+from datetime import timedelta
 import json
 import logging
 import os.path
+import sys
 
 from tempfile import gettempdir
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from tabulate import tabulate
-
 from vendor import registry
-from inventory import Base, Device
+from utils import http
+from utils.metrics import METRICS_FORMATS, metrics
+from utils.formats import FORMATS, OUTPUT_FORMATS, guess_format, read_records, record_writer
+
+# Vendor modules, SQLAlchemy, tabulate and the inventory models are imported by the commands that
+# use them so that commands like --help and list-vendor start quickly
 
 __all__ = ['Config', "HomeNetChecker', 'RegisterCommand"]
 
@@ -18,7 +21,6 @@ parser = argparse.ArgumentParser()
 subparsers = parser.add_subparsers(title='subcommands', help='Operations to be performed')
 
 logger = logging.getLogger('homenet')
-registry.load_vendors()
 
 # TODO: Move classes to separate file?
 # TODO: Split commands?
@@ -29,6 +31,25 @@ class Config:
     log_level = logging.INFO
     log_file = None
     cache_dir = None
+    workers = 8
+    vendor_workers = 4
+    max_age = 86400
+    http_timeout = 30
+    http_retries = 3
+    http_cache = True
+    host_connections = 2
+    release_cache_ttl = 3600
+    release_cache_size = 1024
+    release_cache_persist = False
+    serve_host = '127.0.0.1'
+    serve_port = 8470
+    check_interval = None
+    check_jitter = 0.1
+    retry_interval = 900
+    reload_interval = 300
+    vendor_rate = 1.0
+    discovery_concurrency = 128
+    discovery_timeout = 2
 
     def __init__(self, config_fp):
         if config_fp:
@@ -39,7 +60,7 @@ class Config:
     def load(self, fp):
         config = json.load(fp)
         if 'dsn' in config:
-            self.dsn = config.dsn
+            self.dsn = config['dsn']
         if 'log' in config:
             if 'level' in config['log']:
                 self.log_level = config['log']['level'].upper()
@@ -47,6 +68,49 @@ class Config:
                 self.log_file = config['log']['file']
         if 'cache' in config:
             self.cache_dir = config['cache']
+        if 'query' in config:
+            if 'workers' in config['query']:
+                self.workers = int(config['query']['workers'])
+            if 'vendor_workers' in config['query']:
+                self.vendor_workers = int(config['query']['vendor_workers'])
+            if 'max_age' in config['query']:
+                self.max_age = float(config['query']['max_age'])
+        if 'http' in config:
+            if 'timeout' in config['http']:
+                self.http_timeout = float(config['http']['timeout'])
+            if 'retries' in config['http']:
+                self.http_retries = int(config['http']['retries'])
+            if 'cache' in config['http']:
+                self.http_cache = bool(config['http']['cache'])
+            if 'host_connections' in config['http']:
+                self.host_connections = int(config['http']['host_connections'])
+        if 'release_cache' in config:
+            if 'ttl' in config['release_cache']:
+                self.release_cache_ttl = float(config['release_cache']['ttl'])
+            if 'size' in config['release_cache']:
+                self.release_cache_size = int(config['release_cache']['size'])
+            if 'persist' in config['release_cache']:
+                self.release_cache_persist = bool(config['release_cache']['persist'])
+        if 'serve' in config:
+            if 'host' in config['serve']:
+                self.serve_host = config['serve']['host']
+            if 'port' in config['serve']:
+                self.serve_port = int(config['serve']['port'])
+            if 'interval' in config['serve']:
+                self.check_interval = float(config['serve']['interval'])
+            if 'jitter' in config['serve']:
+                self.check_jitter = float(config['serve']['jitter'])
+            if 'retry_interval' in config['serve']:
+                self.retry_interval = float(config['serve']['retry_interval'])
+            if 'reload_interval' in config['serve']:
+                self.reload_interval = float(config['serve']['reload_interval'])
+            if 'vendor_rate' in config['serve']:
+                self.vendor_rate = float(config['serve']['vendor_rate'])
+        if 'discovery' in config:
+            if 'concurrency' in config['discovery']:
+                self.discovery_concurrency = int(config['discovery']['concurrency'])
+            if 'timeout' in config['discovery']:
+                self.discovery_timeout = float(config['discovery']['timeout'])
 
 
 class RegisterCommand:
@@ -69,21 +133,47 @@ def non_empty_argument(arg):
         raise argparse.ArgumentTypeError('Value cannot be an empty string')
     return arg
 
+def vendor_id_argument(arg):
+    # Validated here rather than with choices, which argparse lists (loading plugins) when building the parser
+    if arg not in registry.keys():
+        raise argparse.ArgumentTypeError('Unknown vendor ID {!r}, see list-vendor'.format(arg))
+    return arg
+
 class HomeNetChecker():
+    _session = None
+    _session_factory = None
+
     def __init__(self, config):
         self.config = config
-        self.session = self._get_db()
-        logger.debug('Loaded vendors: %d', len(registry.keys()))
+
+    @property
+    def session(self):
+        """Database session, connected on first use"""
+        if self._session is None:
+            self._session = self._get_db()
+        return self._session
+
+    @property
+    def session_factory(self):
+        """Session class bound to the database engine, for commands using sessions from several threads"""
+        if self._session_factory is None:
+            from sqlalchemy import create_engine
+            from sqlalchemy.orm import sessionmaker
+            from inventory import instrument_engine
+            engine = create_engine(self.config.dsn)
+            instrument_engine(engine)
+            # Devices are read by the vendor check threads while results are committed, avoid reloading them
+            self._session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+        return self._session_factory
 
     def _get_db(self):
-        engine = create_engine(self.config.dsn)
-        Session = sessionmaker(bind=engine)
-        return Session()
+        return self.session_factory()
 
     @RegisterCommand('initialize-db', 'Create database table structure')
     def init_db(self, args):
         from alembic.config import Config
         from alembic import command
+        from inventory import Base
         alembic_cfg = Config('alembic.ini')
         alembic_cfg.set_main_option("sqlalchemy.url", self.config.dsn)
         engine = self.session.get_bind()
@@ -99,42 +189,203 @@ class HomeNetChecker():
             command.upgrade(alembic_cfg, "head")
             logger.debug('Alembic upgrade completed (if any)')
 
-    @RegisterCommand('query', 'Check for available device updates')
+    @RegisterCommand('query', 'Check for available device updates', [
+        {'name': '--workers', 'type': int, 'help': 'Number of devices to check concurrently'},
+        {'name': '--incremental', 'action': 'store_true', 'help': 'Only check devices whose last result is older than the maximum age'},
+        {'name': '--max-age', 'type': float, 'help': 'Maximum age in seconds of a stored result before re-checking (implies --incremental)'},
+        {'name': '--format', 'choices': OUTPUT_FORMATS, 'default': 'table', 'help': 'Output format, all formats except table are written as each result is available'},
+        {'name': '--updates-only', 'action': 'store_true', 'help': 'Only output devices with an available update'},
+        {'name': '--unordered', 'action': 'store_true', 'help': 'Output results as checks complete rather than in device order'}])
     def query(self, args):
-        # TODO: Determine notification scheme / output format
-        devices = self.session.query(Device).order_by(Device.id)
-        if devices:
-            for device in devices:
-                logger.debug('Checking for updates for %s %s', device.vendor_id, device.model)
-                release = device.get_available_update()
-                if release is not None:
-                    print('Update available for {} {}: {}'.format(device.vendor_id, device.model, release.__dict__))
-        else:
+        from concurrent.futures import as_completed
+        from sqlalchemy.orm import joinedload
+        from inventory import Device, QUERY_FIELDS, query_record, submit_checks
+        from utils.concurrency import KeyedExecutor
+
+        devices = self.session.query(Device).options(joinedload(Device.latest_release)).order_by(Device.id).all()
+        if not devices:
             logger.info('No devices configured')
+            return
+
+        max_age = None
+        if args.incremental or args.max_age is not None:
+            max_age = timedelta(seconds=args.max_age if args.max_age is not None else self.config.max_age)
+
+        writer = record_writer(sys.stdout, args.format, QUERY_FIELDS)
+        reported = 0
+
+        def report(device, check):
+            nonlocal reported
+            error = None
+            if check is None:
+                release = device.latest_release.to_release()
+            else:
+                try:
+                    release = check.result()
+                    device.record_release(release)
+                except Exception as e:
+                    logger.error('Failed to check for updates for %s %s (device %d): %s', device.vendor_id, device.model, device.id, e)
+                    release = None
+                    error = str(e)
+            if device.is_outdated_by(release) or not args.updates_only:
+                writer.write(query_record(device, release, error))
+                sys.stdout.flush()
+            reported += 1
+            if reported % 100 == 0:
+                self.session.commit()
+
+        workers = args.workers or self.config.workers
+        with KeyedExecutor(workers, self.config.vendor_workers) as executor:
+            # Checks run concurrently (limited per vendor), devices of vendors supporting it in batches
+            stale = [device for device in devices
+                if max_age is None or device.latest_release is None or device.latest_release.is_stale(max_age)]
+            submitted = dict(zip((device.id for device in stale), submit_checks(executor, stale)))
+            checks = [(device, submitted.get(device.id)) for device in devices]
+            logger.debug('Checking %d of %d devices', sum(1 for _, check in checks if check), len(checks))
+
+            if args.unordered:
+                pending = {}
+                for device, check in checks:
+                    if check is None:
+                        report(device, None)
+                    else:
+                        pending[check] = device
+                for check in as_completed(pending):
+                    report(pending[check], check)
+            else:
+                for device, check in checks:
+                    report(device, check)
+        writer.close()
+        self.session.commit()
+
+    @RegisterCommand('serve', 'Continuously re-check devices and serve the results through a local HTTP/JSON API', [
+        {'name': '--host', 'help': 'Address to listen on (default 127.0.0.1)'},
+        {'name': '--port', 'type': int, 'help': 'Port to listen on (default 8470)'},
+        {'name': '--interval', 'type': float, 'help': 'Seconds between checks of a device (default query.max_age)'}])
+    def serve(self, args):
+        import signal
+        from service import CheckService
+        from service.api import ApiServer
 
+        if args.interval is not None:
+            self.config.check_interval = args.interval
+        service = CheckService(self.config, self.session_factory)
+        api = ApiServer(service, args.host or self.config.serve_host, args.port or self.config.serve_port)
+
+        def terminate(signum, frame):
+            raise SystemExit(0)
+        signal.signal(signal.SIGTERM, terminate)
+
+        service.start()
+        logger.info('Serving results on http://%s:%d/', *api.server_address[:2])
+        try:
+            api.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info('Stopping')
+            api.server_close()
+            service.stop()
+
+    @RegisterCommand('refresh-versions', 'Read the current version of devices from their management address', [
+        {'name': '--vendor-id', 'type': vendor_id_argument, 'metavar': 'VENDOR_ID', 'help': 'Only refresh devices of this vendor'},
+        {'name': '--concurrency', 'type': int, 'help': 'Maximum number of devices probed at once (default discovery.concurrency)'},
+        {'name': '--timeout', 'type': float, 'help': 'Seconds to wait for each device (default discovery.timeout)'}])
+    def refresh_versions(self, args):
+        from discovery import Discoverer
+        from inventory import Device, update_versions
+
+        devices = self.session.query(Device).filter(Device.address.isnot(None))
+        if args.vendor_id:
+            devices = devices.filter(Device.vendor_id == args.vendor_id)
+        devices = devices.order_by(Device.id).all()
+        if not devices:
+            logger.info('No devices with an address configured')
+            return
+
+        discoverer = Discoverer(args.concurrency or self.config.discovery_concurrency, args.timeout or self.config.discovery_timeout)
+        versions = discoverer.versions(devices)
+        changed = {}
+        for device in devices:
+            version = versions.get(device.id)
+            if version is not None and version != device.version:
+                logger.debug('Device %d version changed from %s to %s', device.id, device.version, version)
+                changed[device.id] = version
+        update_versions(self.session, changed)
+        self.session.commit()
+        logger.info('Versions read from %d of %d devices, %d updated', len(versions), len(devices), len(changed))
+
+    @RegisterCommand('discover', 'Find supported devices in a network and read their model and version', [
+        {'name': 'network', 'help': 'Network to probe in CIDR notation, e.g. 192.168.1.0/24'},
+        {'name': '--port', 'type': int, 'help': 'Port of the management pages (default 80, or 443 with --tls)'},
+        {'name': '--tls', 'action': 'store_true', 'help': 'Use HTTPS, without verifying certificates'},
+        {'name': '--add', 'action': 'store_true', 'help': 'Add the devices found to the inventory, updating the version of known devices'},
+        {'name': '--format', 'choices': OUTPUT_FORMATS, 'default': 'table', 'help': 'Output format'},
+        {'name': '--concurrency', 'type': int, 'help': 'Maximum number of addresses probed at once (default discovery.concurrency)'},
+        {'name': '--timeout', 'type': float, 'help': 'Seconds to wait for each address (default discovery.timeout)'}])
+    def discover(self, args):
+        from discovery import Discoverer
+        from inventory import upsert_devices
+
+        discoverer = Discoverer(args.concurrency or self.config.discovery_concurrency, args.timeout or self.config.discovery_timeout)
+        found = discoverer.discover(args.network, args.port, args.tls)
+        writer = record_writer(sys.stdout, args.format, ['address', 'vendor_id', 'model', 'version'])
+        for device in found:
+            writer.write(device)
+        writer.close()
+        if not found:
+            logger.info('No supported devices found in %s', args.network)
+        elif args.add:
+            # Devices are matched on vendor, model and address as with import-devices
+            # A version that couldn't be read doesn't replace the recorded one
+            devices = [{k: v for k, v in device.items() if v is not None} for device in found if device['model']]
+            if len(devices) < len(found):
+                logger.warning('%d devices do not reveal their model and were not added, use add-device for them', len(found) - len(devices))
+            inserted, updated = upsert_devices(self.session, devices)
+            self.session.commit()
+            logger.info('Devices discovered: %d added, %d updated', inserted, updated)
 
     @RegisterCommand('list-vendor', 'Print list of supported vendors')
     def vendor_list(self, args):
-        vendors = [{'ID': vendor.__class__.id(), 'Name': vendor.name()} for vendor in registry.values()]
+        from tabulate import tabulate
+        vendors = [{'ID': vendor_id, 'Name': registry.name(vendor_id)} for vendor_id in registry.keys()]
         print(tabulate(vendors, headers='keys'))
 
-    @RegisterCommand('list-devices', 'Provide list of recorded device information')
+    @RegisterCommand('list-devices', 'Provide list of recorded device information', [
+        {'name': '--format', 'choices': OUTPUT_FORMATS, 'default': 'table', 'help': 'Output format'},
+        {'name': '--outdated', 'action': 'store_true', 'help': 'Only list devices the stored query results found an update for, with the latest version'}])
     def device_list(self, args):
-        devices = self.session.query(Device).order_by(Device.id)
-        if devices:
-            device_list = [device.as_dict() for device in devices]
-            print(tabulate(device_list, headers='keys'))
+        from sqlalchemy.orm import contains_eager
+        from inventory import Device, DEVICE_FIELDS, outdated_devices
+        if args.outdated:
+            fields = DEVICE_FIELDS + ['latest_version', 'download_url', 'checked_at']
+            devices = outdated_devices(self.session).options(contains_eager(Device.latest_release))
         else:
-            logger.info('No devices configured')
+            fields = DEVICE_FIELDS
+            devices = self.session.query(Device)
+        writer = record_writer(sys.stdout, args.format, fields)
+        listed = 0
+        for device in devices.order_by(Device.id).yield_per(500):
+            record = device.as_dict()
+            if args.outdated:
+                record.update(latest_version=device.latest_release.version, download_url=device.latest_release.download_url,
+                    checked_at=device.latest_release.checked_at.isoformat())
+            writer.write(record)
+            listed += 1
+        # Closed even when empty so that JSON output is still a (empty) list
+        writer.close()
+        if not listed:
+            logger.info('No outdated devices found' if args.outdated else 'No devices configured')
 
     @RegisterCommand('add-device', 'Add a device to be checked', [
-        {'name': '--vendor-id', 'choices': registry.keys(), 'help': 'Vendor ID', 'required': True},
+        {'name': '--vendor-id', 'type': vendor_id_argument, 'metavar': 'VENDOR_ID', 'help': 'Vendor ID (see list-vendor)', 'required': True},
         {'name': '--model', 'type': non_empty_argument, 'help': 'Model ID', 'required': True},
         {'name': '--version', 'help': 'Device version'},
         {'name': '--address', 'help': 'IP or web address for the device'},
         {'name': '--description', 'help': 'Description'}])
     def device_add(self, args):
-        keys = [c.name for c in Device.__table__.columns if c.name != 'id']
+        from inventory import Device, DEVICE_FIELDS
+        keys = [field for field in DEVICE_FIELDS if field != 'id']
         values = vars(args)
         device = Device(**{k: values[k] for k in keys if k in values})
         self.session.add(device)
@@ -143,12 +394,13 @@ class HomeNetChecker():
 
     @RegisterCommand('update-device', 'Update information for an existing device', [
         {'name': '--id', 'help': 'Device ID', 'type': int, 'required': True},
-        {'name': '--vendor-id', 'choices': registry.keys(), 'help': 'Vendor ID'},
+        {'name': '--vendor-id', 'type': vendor_id_argument, 'metavar': 'VENDOR_ID', 'help': 'Vendor ID (see list-vendor)'},
         {'name': '--model', 'type': non_empty_argument, 'help': 'Model ID'},
         {'name': '--version', 'help': 'Device version'},
         {'name': '--address', 'help': 'IP or web address for the device'},
         {'name': '--description', 'help': 'Description'}])
     def device_update(self, args):
+        from inventory import Device
         keys = [c.name for c in Device.__mapper__.columns if c.name != 'id']
         values = vars(args)
         device = self.session.query(Device).get(args.id)
@@ -165,7 +417,8 @@ class HomeNetChecker():
 
     @RegisterCommand('delete-device', 'Update information for an existing device', [
         {'name': '--id', 'help': 'Device ID', 'type': int, 'required': True}])
-    def device_update(self, args):
+    def device_delete(self, args):
+        from inventory import Device
         keys = [c.name for c in Device.__mapper__.columns if c.name != 'id']
         values = vars(args)
         device = self.session.query(Device).get(args.id)
@@ -175,23 +428,79 @@ class HomeNetChecker():
         self.session.commit()
         logger.info('Device %d deleted', device.id)
 
+    @RegisterCommand('import-devices', 'Add or update devices from a CSV, JSON or NDJSON file', [
+        {'name': 'file', 'type': argparse.FileType('r'), 'nargs': '?', 'default': '-', 'help': 'File to import (default stdin)'},
+        {'name': '--format', 'choices': FORMATS, 'help': 'File format (default based on file extension, otherwise csv)'},
+        {'name': '--batch-size', 'type': int, 'default': 500, 'help': 'Number of devices written per transaction'}])
+    def device_import(self, args):
+        from inventory import DEVICE_FIELDS, upsert_devices
+        fmt = args.format or guess_format(args.file)
+        keys = [field for field in DEVICE_FIELDS if field != 'id']
+        inserted = updated = skipped = 0
+        batch = []
+        for number, record in enumerate(read_records(args.file, fmt), 1):
+            # JSON records may hold numbers, e.g. a version of 1.2, all columns are strings
+            values = {k: (str(record[k]) if isinstance(record[k], (int, float)) else record[k]) or None for k in keys if k in record}
+            values.setdefault('address', None)
+            if any(value is not None and not isinstance(value, str) for value in values.values()):
+                logger.warning('Skipping record %d: values must be strings or numbers', number)
+                skipped += 1
+                continue
+            if not values.get('vendor_id') or values['vendor_id'] not in registry.keys() or not values.get('model'):
+                logger.warning('Skipping record %d: a known vendor_id and a model are required', number)
+                skipped += 1
+                continue
+            batch.append(values)
+            if len(batch) >= args.batch_size:
+                counts = upsert_devices(self.session, batch)
+                self.session.commit()
+                inserted, updated = inserted + counts[0], updated + counts[1]
+                batch = []
+        counts = upsert_devices(self.session, batch)
+        self.session.commit()
+        inserted, updated = inserted + counts[0], updated + counts[1]
+        logger.info('Devices imported: %d added, %d updated, %d skipped', inserted, updated, skipped)
+
+    @RegisterCommand('export-devices', 'Write all devices to a CSV, JSON or NDJSON file', [
+        {'name': 'file', 'type': argparse.FileType('w'), 'nargs': '?', 'default': '-', 'help': 'File to write (default stdout)'},
+        {'name': '--format', 'choices': FORMATS, 'help': 'File format (default based on file extension, otherwise csv)'}])
+    def device_export(self, args):
+        from inventory import Device, DEVICE_FIELDS
+        fmt = args.format or guess_format(args.file)
+        writer = record_writer(args.file, fmt, DEVICE_FIELDS)
+        for device in self.session.query(Device).order_by(Device.id).yield_per(500):
+            writer.write(device.as_dict())
+        writer.close()
+        args.file.flush()
+
 
 def homenet():
     parser.add_argument('--config', '-c', type=argparse.FileType('r'),
         help='Path to configuration file')
+    parser.add_argument('--metrics', choices=METRICS_FORMATS,
+        help='Report timings, byte counts, cache hits and errors of the run to standard error in this format')
+    parser.add_argument('--metrics-file', type=argparse.FileType('w'),
+        help='Write the metrics report to this file instead of standard error (Prometheus format unless --metrics is given)')
     args = parser.parse_args()
     config = Config(args.config)
     registry.init_config(config)
+    http.configure(config)
     log_config = {'level': config.log_level}
     if config.log_file:
         log_config['filename'] = config.log_file,
         log_config['filemode'] = 'a'
     logging.basicConfig(**log_config)
     checker = HomeNetChecker(config)
-    if 'func' in args:
-        args.func(checker, args)
-    else:
-        parser.print_help()
+    try:
+        if 'func' in args:
+            args.func(checker, args)
+        else:
+            parser.print_help()
+    finally:
+        registry.close()
+        if args.metrics or args.metrics_file:
+            output = args.metrics_file or sys.stderr
+            output.write(metrics.report(args.metrics or 'prometheus').rstrip('\n') + '\n')
 
 if __name__ == '__main__':
     homenet()
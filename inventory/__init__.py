@@ -1,12 +1,18 @@
+from concurrent.futures import Future
+from datetime import datetime
 import logging
+import time
 
-from cmp_version import cmp_version
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, event, or_
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship, validates
 
-from vendor import registry
+from utils.metrics import metrics
+from utils.version import version_key
+from vendor import registry, Release
 
-__all__ = ['Base', 'Device']
+__all__ = ['Base', 'Device', 'DEVICE_FIELDS', 'DeviceRelease', 'instrument_engine', 'outdated_devices', 'QUERY_FIELDS',
+    'query_record', 'resolve_batch', 'submit_checks', 'update_versions', 'upsert_devices']
 
 logger = logging.getLogger('inventory')
 
@@ -22,6 +28,23 @@ class Device(Base):
     version = Column(String(80), comment='Device current known version')
     description = Column(String(255), comment='Meaningful description (like "Home router")')
     address = Column(String(255), comment='Network address for management console (e.g. IP or Web Address)')
+    version_key = Column(String(160), index=True, comment='Sortable form of version (see utils.version), maintained with version')
+    latest_release = relationship('DeviceRelease', uselist=False, back_populates='device', cascade='all, delete-orphan')
+
+    @validates('version')
+    def _set_version(self, key, version):
+        self.version_key = version_key(version)
+        return version
+
+    @validates('vendor_id', 'model')
+    def _set_lookup(self, key, value):
+        # The stored release was looked up for the previous vendor and model
+        if getattr(self, key) is not None and getattr(self, key) != value:
+            self.latest_release = None
+        return value
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in DEVICE_FIELDS}
 
     def get_vendor(self):
         vendor = registry.get(self.vendor_id)
@@ -29,17 +52,222 @@ class Device(Base):
             raise ValueError("Vendor not found")
         return vendor
 
-    def get_available_update(self):
+    def get_latest_release(self):
         vendor = self.get_vendor()
-        release = vendor.get_latest(self)
-        if release is None:
-            return None
-        logger.debug('Release information: %s', release.__dict__)
-        logger.debug('Latest version for %s %s is %s, current: %s', vendor.name(), self.model, release.version, self.version)
-        if self.version is None or cmp_version(release.version, self.version) > 0:
+        logger.debug('Checking for updates for %s %s', self.vendor_id, self.model)
+        with metrics.timer('vendor_get_latest', vendor=self.vendor_id), metrics.timer('device_check', device=self.id):
+            release = vendor.get_latest(self)
+        if release is not None:
+            logger.debug('Release information: %s', release.__dict__)
+            logger.debug('Latest version for %s %s is %s, current: %s', vendor.name(), self.model, release.version, self.version)
+        return release
+
+    def is_outdated_by(self, release):
+        """Check if the release is newer than the device's current version"""
+        if release is None or release.version is None:
+            return False
+        # Compared the same way as outdated_devices() does in the database
+        return self.version is None or version_key(release.version) > self.version_key
+
+    def get_available_update(self):
+        release = self.get_latest_release()
+        if self.is_outdated_by(release):
             return release
 
+    def record_release(self, release):
+        """Store the result of checking the vendor for the latest release"""
+        if self.latest_release is None:
+            self.latest_release = DeviceRelease()
+        self.latest_release.update(release)
+
     def has_update(self):
         newer = self.get_available_update()
         return newer is not None
 
+
+
+# Device columns as provided by users, i.e. excluding the derived version_key
+DEVICE_FIELDS = ['id', 'model', 'vendor_id', 'version', 'description', 'address']
+
+QUERY_FIELDS = ['id', 'vendor_id', 'model', 'version', 'latest_version', 'update_available', 'download_url',
+    'docs_url', 'notes', 'hash_type', 'hash_sum', 'file_size', 'release_date', 'checked_at', 'error']
+
+
+def query_record(device, release, error=None):
+    """Output record for the result of checking a device"""
+    record = {field: getattr(release, field, None) for field in QUERY_FIELDS}
+    record.update({
+        'id': device.id,
+        'vendor_id': device.vendor_id,
+        'model': device.model,
+        'version': device.version,
+        'latest_version': release.version if release is not None else None,
+        'update_available': device.is_outdated_by(release),
+        'checked_at': device.latest_release.checked_at.isoformat() if device.latest_release is not None else None,
+        'error': error,
+    })
+    return record
+
+
+def submit_checks(executor, devices):
+    """Submit the checks of the devices to a KeyedExecutor, keyed by vendor ID
+
+    Devices of vendors with a batch_size are looked up together through registry.get_latest_many,
+    which falls back to checking each device of a batch that failed as a whole. Returns a Future per
+    device, in the same order, for the device's latest release.
+    """
+    checks = [None] * len(devices)
+    batches = {}
+    for position, device in enumerate(devices):
+        vendor = registry.get(device.vendor_id)
+        if vendor is not None and vendor.batch_size:
+            batches.setdefault(device.vendor_id, []).append(position)
+        else:
+            checks[position] = executor.submit(device.vendor_id, device.get_latest_release)
+    for vendor_id, positions in batches.items():
+        vendor = registry.get(vendor_id)
+        # Use as many batches as checks of the vendor can run at once, lookups within a batch are sequential
+        size = min(vendor.batch_size, -(-len(positions) // executor.key_limit))
+        for start in range(0, len(positions), size):
+            batch = [devices[position] for position in positions[start:start + size]]
+            futures = [Future() for _ in batch]
+            for position, future in zip(positions[start:start + size], futures):
+                checks[position] = future
+            check = executor.submit(vendor_id, registry.get_latest_many, batch)
+            check.add_done_callback(lambda check, batch=batch, futures=futures: resolve_batch(batch, futures, check))
+    return checks
+
+
+def resolve_batch(devices, futures, check):
+    """Complete a Future per device from the Future of a registry.get_latest_many call"""
+    for device, future in zip(devices, futures):
+        if check.cancelled():
+            future.cancel()
+        elif check.exception() is not None:
+            future.set_exception(check.exception())
+        else:
+            release = check.result().get(device.id)
+            if isinstance(release, Exception):
+                future.set_exception(release)
+            else:
+                future.set_result(release)
+
+
+def upsert_devices(session, devices):
+    """Insert or update a batch of devices (dicts of column values) using bulk operations
+
+    Devices are matched on vendor ID, model and address. Returns the number of inserted and updated
+    devices; the caller is responsible for committing.
+    """
+    batch = {}
+    for values in devices:
+        # Bulk operations bypass the version validator
+        if 'version' in values:
+            values = dict(values, version_key=version_key(values['version']))
+        batch[(values['vendor_id'], values['model'], values.get('address'))] = values
+    if not batch:
+        return 0, 0
+
+    existing = {}
+    models = {model for _, model, _ in batch}
+    query = session.query(Device.id, Device.vendor_id, Device.model, Device.address).filter(Device.model.in_(models))
+    for device_id, vendor_id, model, address in query:
+        existing.setdefault((vendor_id, model, address), device_id)
+
+    inserts = []
+    updates = []
+    for key, values in batch.items():
+        if key in existing:
+            updates.append(dict(values, id=existing[key]))
+        else:
+            inserts.append(values)
+    if inserts:
+        session.bulk_insert_mappings(Device, inserts)
+    if updates:
+        session.bulk_update_mappings(Device, updates)
+    return len(inserts), len(updates)
+
+
+def update_versions(session, versions):
+    """Set the version of devices from a dict of device ID to version using a bulk update
+
+    The caller is responsible for committing.
+    """
+    session.bulk_update_mappings(Device, [{'id': device_id, 'version': version, 'version_key': version_key(version)}
+        for device_id, version in versions.items()])
+
+
+def outdated_devices(session):
+    """Query for the devices whose stored latest release is newer than their version, without contacting vendors"""
+    return session.query(Device).join(Device.latest_release).filter(
+        DeviceRelease.version_key.isnot(None),
+        or_(Device.version_key.is_(None), DeviceRelease.version_key > Device.version_key))
+
+
+def instrument_engine(engine):
+    """Time the statements executed through the engine in the db_query metric, by statement type"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info['query_start'].pop()
+        metrics.observe('db_query', time.perf_counter() - start, statement=_statement_type(statement))
+
+    @event.listens_for(engine, 'handle_error')
+    def failed_execute(context):
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+        metrics.inc('db_query_errors', statement=_statement_type(context.statement))
+
+
+def _statement_type(statement):
+    words = (statement or '').split(None, 1)
+    return words[0].upper() if words else ''
+
+
+class DeviceRelease(Base):
+    __tablename__ = 'device_releases'
+    id = Column(Integer, primary_key=True, comment='Generated release record ID')
+    device_id = Column(Integer, ForeignKey('devices.id', ondelete='CASCADE'), nullable=False, unique=True, comment='Device the release was looked up for')
+    version = Column(String(80), comment='Latest version available from the vendor (empty if none was found)')
+    version_key = Column(String(160), index=True, comment='Sortable form of version (see utils.version), maintained with version')
+    download_url = Column(String(1024), comment='Firmware download address')
+    docs_url = Column(String(1024), comment='Release notes or documentation address')
+    notes = Column(String(1024), comment='Additional release notes')
+    hash_type = Column(String(30), comment='Hash algorithm of hash_sum')
+    hash_sum = Column(String(255), comment='Hash of the firmware download')
+    file_size = Column(String(30), comment='Firmware download size as published by the vendor')
+    release_date = Column(String(50), comment='Release date as published by the vendor')
+    source_etag = Column(String(255), comment='ETag of the vendor data the release was read from')
+    checked_at = Column(DateTime, nullable=False, index=True, comment='Time (UTC) the vendor was last checked')
+    device = relationship('Device', back_populates='latest_release')
+
+    _release_fields = ['version', 'download_url', 'docs_url', 'notes', 'hash_type', 'hash_sum', 'file_size', 'release_date', 'source_etag']
+
+    @validates('version')
+    def _set_version(self, key, version):
+        self.version_key = version_key(version)
+        return version
+
+    @validates('vendor_id', 'model')
+    def _set_lookup(self, key, value):
+        # The stored release was looked up for the previous vendor and model
+        if getattr(self, key) is not None and getattr(self, key) != value:
+            self.latest_release = None
+        return value
+
+    def update(self, release):
+        for field in self._release_fields:
+            setattr(self, field, getattr(release, field) if release is not None else None)
+        self.checked_at = datetime.utcnow()
+
+    def to_release(self):
+        if self.version is None:
+            return None
+        return Release(**{field: getattr(self, field) for field in self._release_fields})
+
+    def is_stale(self, max_age):
+        """Check if the release was last checked more than max_age (timedelta) ago"""
+        return self.checked_at < datetime.utcnow() - max_age
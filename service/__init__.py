@@ -0,0 +1,274 @@
+"""
+Long running checker that keeps vendors, HTTP connections and vendor databases warm between checks
+"""
+
+from concurrent.futures import Future
+from datetime import timezone
+import heapq
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy.orm import joinedload
+
+from inventory import Device, query_record, resolve_batch
+from utils.concurrency import KeyedExecutor
+from utils.metrics import metrics
+from vendor import registry
+
+__all__ = ['CheckService']
+
+logger = logging.getLogger('service')
+
+
+class CheckService:
+    """Re-check every device of the inventory on its own schedule
+
+    Each device is due interval seconds (spread by +/- jitter) after its last check, or
+    retry_interval seconds after a failed check. Checks of a vendor are started at most vendor_rate
+    times per second (unlimited if 0) and run in the shared worker pool; devices of a vendor with a
+    batch_size that are due together are looked up in one check. The inventory is re-read every
+    reload_interval seconds to pick up added, changed and removed devices.
+    """
+
+    def __init__(self, config, session_factory):
+        self.config = config
+        self.Session = session_factory
+        self.interval = config.check_interval or config.max_age
+        self.jitter = config.check_jitter
+        self.retry_interval = config.retry_interval
+        self.reload_interval = config.reload_interval
+        self.vendor_rate = config.vendor_rate
+        self.started_at = None
+        self._devices = {}
+        self._records = {}
+        self._schedule = []
+        self._due = {}
+        self._checking = set()
+        # Devices to check again as soon as their running check completes
+        self._dirty = set()
+        self._vendor_slots = {}
+        self._reloaded_at = 0
+        self._running = False
+        self._condition = threading.Condition()
+        # SQLite allows one writer; results are stored one at a time
+        self._store_lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+
+    def start(self):
+        self._executor = KeyedExecutor(self.config.workers, self.config.vendor_workers)
+        self._running = True
+        self.started_at = time.time()
+        self.reload()
+        self._thread = threading.Thread(target=self._run, name='homenet-scheduler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop scheduling, waiting for running checks but dropping queued ones"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait_pending=False)
+
+    def reload(self):
+        """Synchronise the schedule with the devices in the inventory"""
+        session = self.Session()
+        try:
+            devices = {device.id: device for device in session.query(Device).options(joinedload(Device.latest_release))}
+        finally:
+            session.close()
+        now = time.time()
+        with self._condition:
+            for device_id, device in devices.items():
+                known = self._devices.get(device_id)
+                self._devices[device_id] = device
+                if known is not None and (known.vendor_id, known.model) == (device.vendor_id, device.model):
+                    if known.version != device.version:
+                        self._records[device_id] = self._stored_record(device)
+                    continue
+                self._records[device_id] = self._stored_record(device)
+                if known is None and device.latest_release is not None:
+                    checked_at = device.latest_release.checked_at.replace(tzinfo=timezone.utc).timestamp()
+                    self._push(max(now, checked_at + self._next_interval()), device_id)
+                else:
+                    self._push(now, device_id)
+            for device_id in set(self._devices) - set(devices):
+                del self._devices[device_id]
+                self._records.pop(device_id, None)
+                self._due.pop(device_id, None)
+            self._reloaded_at = now
+            self._condition.notify_all()
+        logger.debug('Scheduling %d devices', len(devices))
+
+    def check_now(self, device_id):
+        """Move the device to the front of the schedule, returning False for unknown devices
+
+        A device being checked is checked again once the running check completes.
+        """
+        with self._condition:
+            if device_id not in self._devices:
+                return False
+            self._push(time.time(), device_id)
+            self._condition.notify_all()
+            return True
+
+    def records(self):
+        with self._condition:
+            return [self._records[device_id] for device_id in sorted(self._records)]
+
+    def record(self, device_id):
+        with self._condition:
+            return self._records.get(device_id)
+
+    def status(self):
+        with self._condition:
+            return {
+                'status': 'running' if self._running else 'stopped',
+                'started_at': self.started_at,
+                'devices': len(self._devices),
+                'checking': len(self._checking),
+                'next_check': self._schedule[0][0] if self._schedule else None,
+            }
+
+    def _stored_record(self, device):
+        release = device.latest_release.to_release() if device.latest_release is not None else None
+        return query_record(device, release)
+
+    def _next_interval(self, interval=None):
+        interval = interval or self.interval
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _push(self, due, device_id):
+        self._due[device_id] = due
+        heapq.heappush(self._schedule, (due, device_id))
+
+    def _run(self):
+        while self._running:
+            if time.time() >= self._reloaded_at + self.reload_interval:
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error('Failed to reload devices: %s', e)
+                    self._reloaded_at = time.time()
+            with self._condition:
+                self._dispatch()
+
+    def _dispatch(self):
+        """Start the checks that are due, then wait for the next one to be due or the next reload"""
+        now = time.time()
+        batches = {}
+        while self._schedule and self._schedule[0][0] <= now:
+            due, device_id = heapq.heappop(self._schedule)
+            device = self._devices.get(device_id)
+            # Skip devices removed from the inventory and entries superseded by a later _push
+            if device is None or self._due.get(device_id) != due:
+                continue
+            if device_id in self._checking:
+                # The running check may be of a previous model, or older than requested
+                self._dirty.add(device_id)
+                del self._due[device_id]
+                continue
+            vendor = registry.get(device.vendor_id)
+            batch_size = vendor.batch_size if vendor is not None else None
+            # Devices of a vendor with a batch_size that are due together join one lookup, started at the vendor's rate
+            batch = batches.get(device.vendor_id)
+            if batch is None or len(batch) >= batch_size:
+                slot = self._vendor_slots.get(device.vendor_id, 0)
+                if slot > now:
+                    self._push(slot, device_id)
+                    continue
+                if self.vendor_rate:
+                    self._vendor_slots[device.vendor_id] = now + 1 / self.vendor_rate
+            self._checking.add(device_id)
+            del self._due[device_id]
+            if batch_size:
+                if batch is None or len(batch) >= batch_size:
+                    if batch is not None:
+                        self._start_batch(device.vendor_id, batch)
+                    batch = batches[device.vendor_id] = []
+                batch.append(device)
+            else:
+                future = self._executor.submit(device.vendor_id, device.get_latest_release)
+                future.add_done_callback(lambda check, device=device: self._complete(device, check))
+        for vendor_id, batch in batches.items():
+            self._start_batch(vendor_id, batch)
+        wait = self._reloaded_at + self.reload_interval - now
+        if self._schedule:
+            wait = min(wait, self._schedule[0][0] - now)
+        if wait > 0 and self._running:
+            self._condition.wait(wait)
+
+    def _start_batch(self, vendor_id, devices):
+        """Look the devices of a vendor up together, completing each device as a separate check"""
+        def complete(check):
+            futures = [Future() for _ in devices]
+            resolve_batch(devices, futures, check)
+            for device, future in zip(devices, futures):
+                self._complete(device, future)
+        self._executor.submit(vendor_id, registry.get_latest_many, devices).add_done_callback(complete)
+
+    def _complete(self, checked, check):
+        device_id = checked.id
+        if check.cancelled():
+            # Dropped from the queue when stopping
+            with self._condition:
+                self._checking.discard(device_id)
+                self._dirty.discard(device_id)
+            return
+        error = None
+        try:
+            release = check.result()
+        except Exception as e:
+            release = None
+            error = str(e)
+        try:
+            device, stored = self._store(checked, release, error)
+        except Exception as e:
+            logger.error('Failed to store result for device %d: %s', device_id, e)
+            device, stored = None, False
+        with self._condition:
+            self._checking.discard(device_id)
+            recheck = device_id in self._dirty
+            self._dirty.discard(device_id)
+            if device is None or device_id not in self._devices:
+                return
+            self._devices[device_id] = device
+            if stored:
+                self._records[device_id] = query_record(device, release if error is None else None, error)
+                interval = self.retry_interval if error is not None else self.interval
+                due = time.time() + self._next_interval(interval)
+            else:
+                self._records[device_id] = self._stored_record(device)
+                recheck = True
+            self._push(time.time() if recheck else due, device_id)
+            self._condition.notify_all()
+
+    def _store(self, checked, release, error):
+        """Record a check in the inventory, returning the detached device (None if it was removed) and
+        whether the result was kept, which it isn't if the device's vendor or model changed meanwhile
+        """
+        with self._store_lock:
+            session = self.Session()
+            try:
+                device = session.query(Device).options(joinedload(Device.latest_release)).get(checked.id)
+                if device is None:
+                    return None, False
+                if (device.vendor_id, device.model) != (checked.vendor_id, checked.model):
+                    logger.debug('Discarding result for device %d, changed to %s %s during the check', device.id, device.vendor_id, device.model)
+                    metrics.inc('service_checks', vendor=checked.vendor_id, result='discarded')
+                    return device, False
+                if error is None:
+                    device.record_release(release)
+                    session.commit()
+                else:
+                    logger.error('Failed to check for updates for %s %s (device %d): %s', device.vendor_id, device.model, device.id, error)
+                metrics.inc('service_checks', vendor=device.vendor_id, result='ok' if error is None else 'error')
+                return device, True
+            finally:
+                session.close()
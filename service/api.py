@@ -0,0 +1,76 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import re
+
+from utils.metrics import metrics
+
+__all__ = ['ApiServer']
+
+logger = logging.getLogger('service.api')
+
+_DEVICE_PATH = re.compile(r'^/devices/(\d+)(/check)?$')
+
+
+class ApiServer(ThreadingHTTPServer):
+    """Local HTTP/JSON API over the results of a CheckService
+
+    GET /health                 Scheduler status
+    GET /devices                Latest result of every device (?updates=1 for devices with an available update)
+    GET /devices/<id>           Latest result of a device
+    POST /devices/<id>/check    Check the device as soon as its vendor allows
+    GET /metrics                Metrics in Prometheus text format
+    """
+    daemon_threads = True
+
+    def __init__(self, service, host='127.0.0.1', port=8470):
+        self.service = service
+        super().__init__((host, port), _Handler)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        service = self.server.service
+        if path == '/health':
+            self._send_json(200, service.status())
+        elif path == '/devices':
+            records = service.records()
+            if 'updates=1' in query.split('&'):
+                records = [record for record in records if record['update_available']]
+            self._send_json(200, records)
+        elif path == '/metrics':
+            self._send(200, 'text/plain; version=0.0.4', metrics.report('prometheus').encode('utf-8'))
+        else:
+            match = _DEVICE_PATH.match(path)
+            record = service.record(int(match.group(1))) if match and not match.group(2) else None
+            if record is None:
+                self._send_json(404, {'error': 'Not found'})
+            else:
+                self._send_json(200, record)
+
+    def do_POST(self):
+        # Requests need no body, discard any so the connection can be reused
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        match = _DEVICE_PATH.match(self.path)
+        if not match or not match.group(2):
+            self._send_json(404, {'error': 'Not found'})
+        elif self.server.service.check_now(int(match.group(1))):
+            self._send_json(202, {'status': 'scheduled'})
+        else:
+            self._send_json(404, {'error': 'Device not found'})
+
+    def _send_json(self, status, data):
+        self._send(status, 'application/json', json.dumps(data, default=str).encode('utf-8'))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
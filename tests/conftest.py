@@ -0,0 +1,27 @@
+import importlib.util
+import os.path
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_cli():
+    """Import homenet-check.py, whose name isn't a valid module name"""
+    spec = importlib.util.spec_from_file_location('homenet_check', os.path.join(ROOT, 'homenet-check.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def config(tmp_path):
+    from vendor import registry
+    config = load_cli().Config(None)
+    config.cache_dir = str(tmp_path)
+    config.dsn = 'sqlite:///{}'.format(tmp_path / 'inv.db')
+    registry.init_config(config)
+    yield config
+    registry.close()
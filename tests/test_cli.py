@@ -0,0 +1,60 @@
+import json
+import os.path
+import subprocess
+import sys
+
+from conftest import ROOT
+
+CLI = os.path.join(ROOT, 'homenet-check.py')
+
+
+def run_python(code):
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+
+
+def test_parser_does_not_load_plugins():
+    # A fresh interpreter, as other tests load the plugins of the shared registry
+    output = run_python(
+        'import importlib.util\n'
+        'spec = importlib.util.spec_from_file_location("homenet_check", {!r})\n'
+        'module = importlib.util.module_from_spec(spec)\n'
+        'spec.loader.exec_module(module)\n'
+        'args = module.parser.parse_args(["add-device", "--vendor-id", "netgear", "--model", "R7000"])\n'
+        'from vendor import registry\n'
+        'print(args.vendor_id, registry._plugins_loaded)\n'.format(CLI))
+    assert output.split() == ['netgear', 'False']
+
+
+def test_unknown_vendor_rejected():
+    result = subprocess.run([sys.executable, CLI, 'add-device', '--vendor-id', 'nope', '--model', 'X'], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 2
+    assert "Unknown vendor ID 'nope'" in result.stderr
+
+
+def run_cli(tmp_path, *args):
+    config = tmp_path / 'config.json'
+    config.write_text('{{"dsn": "sqlite:///{}", "cache": "{}"}}'.format(tmp_path / 'inv.db', tmp_path))
+    return subprocess.run([sys.executable, CLI, '--config', str(config)] + list(args), cwd=ROOT, capture_output=True, text=True, check=True).stdout
+
+
+def test_list_devices_empty_json(tmp_path):
+    run_cli(tmp_path, 'initialize-db')
+    assert json.loads(run_cli(tmp_path, 'list-devices', '--format', 'json')) == []
+    assert json.loads(run_cli(tmp_path, 'list-devices', '--outdated', '--format', 'json')) == []
+
+
+def test_discover_nothing_json(tmp_path):
+    # Nothing listens on the discard port of the loopback address
+    assert json.loads(run_cli(tmp_path, 'discover', '127.0.0.1/32', '--port', '9', '--format', 'json')) == []
+
+
+def test_import_json_numbers(tmp_path):
+    run_cli(tmp_path, 'initialize-db')
+    devices = tmp_path / 'devices.json'
+    devices.write_text(json.dumps([
+        {'vendor_id': 'netgear', 'model': 'R7000', 'version': 1.2},
+        {'vendor_id': 'netgear', 'model': 'R6400', 'version': {'major': 1}},
+        {'vendor_id': 'netgear', 'model': 'R6700', 'version': 10}]))
+    run_cli(tmp_path, 'import-devices', str(devices))
+    exported = json.loads(run_cli(tmp_path, 'export-devices', '--format', 'json'))
+    assert [(device['model'], device['version']) for device in exported] == [('R7000', '1.2'), ('R6700', '10')]
@@ -0,0 +1,54 @@
+import socket
+import threading
+
+import pytest
+
+from benchmarks.server import DeviceServer
+from discovery import Discoverer
+
+
+@pytest.fixture
+def closing_server():
+    """Server accepting connections and closing them without replying"""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+
+    def serve():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            connection.close()
+    threading.Thread(target=serve, daemon=True).start()
+    yield listener.getsockname()[1]
+    listener.close()
+
+
+def test_discover_device(config):
+    with DeviceServer('netgear', 'R7000', 'V1.0.11.116', host='127.0.0.1') as server:
+        found = Discoverer(timeout=1).discover('127.0.0.1/32', port=server.port)
+    assert found == [{'address': server.address, 'vendor_id': 'netgear', 'model': 'R7000', 'version': '1.0.11.116'}]
+
+
+def test_discover_closed_without_reply(config, closing_server):
+    assert Discoverer(timeout=1).discover('127.0.0.1/32', port=closing_server) == []
+
+
+def test_versions_skips_devices_without_address(config):
+    from inventory import Device
+    devices = [Device(id=1, vendor_id='netgear', model='R7000', address=''), Device(id=2, vendor_id='netgear', model='R7000', address=None)]
+    with DeviceServer('netgear', 'R7000', 'V1.0.11.116', host='127.0.0.1') as server:
+        devices.append(Device(id=3, vendor_id='netgear', model='R7000', address=server.address))
+        assert Discoverer(timeout=1).versions(devices) == {3: '1.0.11.116'}
+
+
+def test_discover_ipv6_without_port(config):
+    # Nothing answers on port 80 of the loopback address, the probe must just go unanswered
+    assert Discoverer(timeout=1).discover('::1/128') == []
+
+
+def test_versions_unparseable_address(config):
+    from inventory import Device
+    assert Discoverer(timeout=1).versions([Device(id=1, vendor_id='netgear', model='R7000', address='::1')]) == {}
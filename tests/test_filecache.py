@@ -0,0 +1,15 @@
+import os
+
+import pytest
+
+from utils.filecache import CachedFile
+
+
+def test_write_meta_failure_removes_temp_file(tmp_path):
+    cached = CachedFile(str(tmp_path / 'data'), 'http://127.0.0.1/data')
+    with pytest.raises(TypeError):
+        cached._write_meta({'url': cached.url, 'checked': object()})
+    assert os.listdir(str(tmp_path)) == []
+    cached._write_meta({'url': cached.url, 'checked': 1})
+    assert cached.meta() == {'url': cached.url, 'checked': 1}
+    assert os.listdir(str(tmp_path)) == ['data.meta']
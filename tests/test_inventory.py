@@ -0,0 +1,92 @@
+import pytest
+
+from inventory import Device, submit_checks
+from utils.concurrency import KeyedExecutor
+from utils.metrics import metrics
+from vendor import Release, Vendor, cached_releases, registry
+
+
+class Batched(Vendor):
+    batch_size = 10
+
+    def id():
+        return 'batched'
+
+    def name(self):
+        return 'Batched'
+
+    def get_latest(self, device):
+        return Release(version='2.0')
+
+    @cached_releases
+    def get_latest_many(self, devices):
+        return {device.id: ValueError('Unknown model') if device.model == 'bad' else Release(version='2.0') for device in devices}
+
+
+@pytest.fixture
+def batched(config):
+    registry.register(Batched)
+    metrics.reset()
+    yield registry.get('batched')
+    registry.unregister('batched')
+    metrics.reset()
+
+
+def _metric(kind, name, **labels):
+    return [entry for entry in metrics.as_dict()[kind] if entry['name'] == name and all(entry['labels'].get(k) == v for k, v in labels.items())]
+
+
+def test_batch_records_device_metrics(batched):
+    devices = [Device(id=n, vendor_id='batched', model=model, version='1.0') for n, model in enumerate(['a', 'a', 'b', 'bad'], 1)]
+    with KeyedExecutor(4, 2) as executor:
+        checks = submit_checks(executor, devices)
+        [check.exception() for check in checks]
+
+    assert sorted(entry['labels']['device'] for entry in _metric('histograms', 'device_check')) == [1, 2, 3, 4]
+    assert _metric('histograms', 'vendor_get_latest', vendor='batched')[0]['count'] == 4
+    assert _metric('counters', 'device_check_errors', device=4)[0]['value'] == 1
+    lookups = {entry['labels']['result']: entry['value'] for entry in _metric('counters', 'cache_lookups', cache='batched_release')}
+    assert lookups == {'hit': 1, 'miss': 3}
+
+
+def test_changing_model_drops_stored_release(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from inventory import Base, DeviceRelease, outdated_devices
+
+    engine = create_engine('sqlite:///{}'.format(tmp_path / 'inv.db'))
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    device = Device(vendor_id='netgear', model='R7000', version='1.0')
+    device.record_release(Release(version='1.0.11.116'))
+    session.add(device)
+    session.commit()
+    assert outdated_devices(session).count() == 1
+
+    device.model = 'R7000'
+    session.commit()
+    assert device.latest_release is not None
+
+    device.model = 'R6400'
+    session.commit()
+    assert device.latest_release is None
+    assert session.query(DeviceRelease).count() == 0
+    assert outdated_devices(session).count() == 0
+
+
+class FailingBatch(Batched):
+    def id():
+        return 'failing'
+
+    def get_latest_many(self, devices):
+        raise ValueError('Batch failed')
+
+
+def test_failed_batch_checked_one_at_a_time(config):
+    registry.register(FailingBatch)
+    try:
+        devices = [Device(id=n, vendor_id='failing', model='m{}'.format(n), version='1.0') for n in range(3)]
+        releases = registry.get_latest_many(devices)
+    finally:
+        registry.unregister('failing')
+    assert {device_id: release.version for device_id, release in releases.items()} == {0: '2.0', 1: '2.0', 2: '2.0'}
@@ -0,0 +1,58 @@
+from contextlib import closing
+import os
+import sqlite3
+import threading
+
+from benchmarks.server import make_toh_dump
+from vendor import registry
+
+
+def test_concurrent_index_builds(config):
+    dump, models, _ = make_toh_dump(2000, 'http://127.0.0.1')
+    openwrt_class = registry.get_class('openwrt')
+    # Separate instances stand in for separate processes sharing the cache directory
+    vendors = [openwrt_class(config) for _ in range(4)]
+    with open(vendors[0]._cache, 'wb') as dump_file:
+        dump_file.write(dump)
+    errors = []
+
+    def build(vendor):
+        try:
+            vendor._build_index('source')
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=build, args=(vendor,)) for vendor in vendors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with closing(sqlite3.connect(vendors[0]._index)) as db:
+        assert db.execute('SELECT COUNT(*) FROM devices WHERE supported = 1').fetchone()[0] == len(set(models))
+    assert [name for name in os.listdir(config.cache_dir) if name.startswith('.tmp-')] == []
+
+
+def test_duplicate_models_supported_by_any_row(config):
+    import csv
+    import gzip
+    import io
+    from benchmarks.server import TOH_COLUMNS
+
+    text = io.StringIO()
+    writer = csv.writer(text, delimiter='\t', lineterminator='\n')
+    writer.writerow(TOH_COLUMNS)
+    rows = [('A', 'X1', '-', ''), ('B', 'Y1', '19.07.2', 'http://x/y1.bin'), ('A', 'X1', '19.07.2', 'http://x/x1.bin'), ('A', 'X1', '18.06.8', 'http://x/x1-old.bin')]
+    for brand, model, release, url in rows:
+        values = dict.fromkeys(TOH_COLUMNS, 'NULL')
+        values.update(brand=brand, model=model, supportedcurrentrel=release, firmwareopenwrtupgradeurl=url)
+        writer.writerow([values[column] for column in TOH_COLUMNS])
+    openwrt = registry.get_class('openwrt')(config)
+    with open(openwrt._cache, 'wb') as dump_file:
+        dump_file.write(gzip.compress(text.getvalue().encode('utf-8')))
+    openwrt._build_index('source')
+
+    with closing(sqlite3.connect(openwrt._index)) as db:
+        assert [model for model, in db.execute('SELECT model FROM devices WHERE supported = 1 ORDER BY position')] == ['B Y1', 'A X1']
+        # Lookups still use the first row of a model
+        assert db.execute("SELECT version, upgrade_url FROM devices WHERE model = 'A X1'").fetchone() == ('-', '')
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from inventory import Base, Device
+from service import CheckService
+from vendor import Release, Vendor, registry
+
+
+class Blocking(Vendor):
+    """Vendor whose checks of the "old" model wait for the test to release them"""
+    checked = []
+    release_old = threading.Event()
+
+    def id():
+        return 'blocking'
+
+    def name(self):
+        return 'Blocking'
+
+    def get_latest(self, device):
+        self.checked.append(device.model)
+        if device.model == 'old':
+            self.release_old.wait(5)
+        return Release(version='{}-2.0'.format(device.model))
+
+
+@pytest.fixture
+def service(config):
+    registry.register(Blocking)
+    Blocking.checked = []
+    Blocking.release_old.clear()
+    engine = create_engine(config.dsn)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    session = Session()
+    session.add(Device(id=1, vendor_id='blocking', model='old', version='1.0'))
+    session.commit()
+    session.close()
+    config.vendor_rate = 0
+    config.reload_interval = 3600
+    service = CheckService(config, Session).start()
+    yield service, Session
+    Blocking.release_old.set()
+    service.stop()
+    registry.unregister('blocking')
+
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, 'Timed out'
+        time.sleep(0.01)
+
+
+def test_device_changed_during_check_is_checked_again(service):
+    service, Session = service
+    wait_for(lambda: Blocking.checked == ['old'])
+
+    session = Session()
+    session.query(Device).get(1).model = 'new'
+    session.commit()
+    session.close()
+    service.reload()
+    assert service.check_now(1)
+    Blocking.release_old.set()
+
+    wait_for(lambda: (service.record(1) or {}).get('latest_version') == 'new-2.0')
+    assert Blocking.checked == ['old', 'new']
+    session = Session()
+    assert session.query(Device).get(1).latest_release.version == 'new-2.0'
+    session.close()
+
+
+def test_check_now_during_check_checks_again(service):
+    service, Session = service
+    wait_for(lambda: Blocking.checked == ['old'])
+    assert service.check_now(1)
+    Blocking.release_old.set()
+    wait_for(lambda: len(Blocking.checked) == 2)
+
+
+class Batched(Vendor):
+    batch_size = 10
+    batches = []
+
+    def id():
+        return 'batched'
+
+    def name(self):
+        return 'Batched'
+
+    def get_latest(self, device):
+        raise AssertionError('Devices should be looked up in batches')
+
+    def get_latest_many(self, devices):
+        self.batches.append(sorted(device.id for device in devices))
+        return {device.id: Release(version='2.0') for device in devices}
+
+
+def test_batch_vendor_devices_checked_together(config):
+    registry.register(Batched)
+    Batched.batches = []
+    engine = create_engine(config.dsn)
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    session = Session()
+    session.add_all([Device(id=n, vendor_id='batched', model='M{}'.format(n), version='1.0') for n in range(1, 13)])
+    session.commit()
+    session.close()
+    config.vendor_rate = 0
+    config.reload_interval = 3600
+    service = CheckService(config, Session).start()
+    try:
+        wait_for(lambda: all((service.record(n) or {}).get('latest_version') == '2.0' for n in range(1, 13)))
+    finally:
+        service.stop()
+        registry.unregister('batched')
+    assert sorted(Batched.batches) == [list(range(1, 11)), [11, 12]]
@@ -0,0 +1,35 @@
+from inventory import Device
+from vendor import Release, Vendor, cached_release, registry
+
+
+class Plugin(Vendor):
+    """External vendor written against the original Vendor, not calling Vendor.__init__"""
+    calls = 0
+
+    def __init__(self, config):
+        self.config = config
+
+    def id():
+        return 'plugin'
+
+    def name(self):
+        return 'Plugin'
+
+    @cached_release
+    def get_latest(self, device):
+        Plugin.calls += 1
+        return Release(version='2.0')
+
+
+def test_vendor_without_super_init(config):
+    registry.register(Plugin)
+    try:
+        plugin = registry.get('plugin')
+        registry.close()
+        device = Device(id=1, vendor_id='plugin', model='P1')
+        assert plugin.get_latest(device).version == '2.0'
+        assert plugin.get_latest(device).version == '2.0'
+        assert Plugin.calls == 1
+        registry.close()
+    finally:
+        registry.unregister('plugin')
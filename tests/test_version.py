@@ -0,0 +1,27 @@
+import pytest
+from cmp_version import cmp_version
+
+from utils.version import version_key
+
+
+def _cmp_keys(version1, version2):
+    key1, key2 = version_key(version1), version_key(version2)
+    return (key1 > key2) - (key1 < key2)
+
+
+@pytest.mark.parametrize('version1,version2', [
+    ('1.0.0.1234567890', '1.0.0.999999999'),
+    ('1.12345678901234567890', '1.9999999999'),
+    ('1.0.0.123456789', '1.0.0.12345678'),
+    ('9_10', '10_1'),
+    ('1.0.2.68_60', '1.0.2.60_1'),
+    ('1.0.68_60', '1.0.6860'),
+    ('V1.0.11.116_10.2.100', 'V1.0.11.116'),
+    ('1.0', '1.0.0'),
+    ('1.1a', '1.19'),
+    ('2:1.0', '10.0'),
+    ('1.0-2', '1.0-10'),
+])
+def test_version_key_orders_like_cmp_version(version1, version2):
+    assert _cmp_keys(version1, version2) == cmp_version(version1, version2)
+    assert _cmp_keys(version2, version1) == cmp_version(version2, version1)
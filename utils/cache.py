@@ -0,0 +1,123 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from utils.metrics import metrics
+
+__all__ = ['TTLCache']
+
+logger = logging.getLogger('utils.cache')
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread safe LRU mapping whose entries expire ttl seconds after being set
+
+    When a path is given the entries can be saved to and loaded from a JSON file so results survive
+    between runs; encode/decode convert values to and from JSON compatible data. Hits and misses of
+    get_or_compute, and those reported with count(), are counted in the cache_lookups metric when a name is given.
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, path=None, encode=None, decode=None, name=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._encode = encode or (lambda value: value)
+        self._decode = decode or (lambda value: value)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Get the cached value for key, calling compute() to fill it on a miss
+
+        Concurrent callers for the same key wait for a single computation instead of repeating it.
+        Exceptions are propagated and not cached.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.count('hit')
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                self.count('miss')
+                value = compute()
+                self.set(key, value)
+            else:
+                self.count('hit')
+            return value
+
+    def count(self, result):
+        """Count a hit or miss in the cache_lookups metric, for lookups made with get() and set()"""
+        if self.name:
+            metrics.inc('cache_lookups', cache=self.name, result=result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def load(self):
+        """Load unexpired entries from the cache file"""
+        try:
+            with open(self.path, 'r') as cache_file:
+                entries = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring unreadable cache file %s: %s', self.path, e)
+            return
+        now = time.time()
+        with self._lock:
+            for key, expires, value in entries:
+                if expires > now:
+                    self._entries[key] = (expires, self._decode(value))
+
+    def save(self):
+        """Write unexpired entries to the cache file, replacing it atomically"""
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            entries = [[key, expires, self._encode(value)] for key, (expires, value) in self._entries.items() if expires > now]
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(temp_path, self.path)
+        except (OSError, TypeError) as e:
+            logger.warning('Failed to save cache file %s: %s', self.path, e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,89 @@
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import logging
+import threading
+
+__all__ = ['KeyedExecutor']
+
+logger = logging.getLogger('utils.concurrency')
+
+
+class KeyedExecutor:
+    """Thread pool limiting how many tasks sharing the same key (e.g. vendor ID) run at once
+
+    Tasks over the key limit are queued without holding a worker thread, so a slow or failing
+    key cannot starve the tasks submitted for other keys.
+    """
+
+    def __init__(self, max_workers, key_limit=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='homenet')
+        self._key_limit = key_limit or max_workers
+        self._lock = threading.Lock()
+        self._running = defaultdict(int)
+        self._pending = defaultdict(deque)
+        # Only unfinished futures are kept so a long running executor doesn't accumulate them
+        self._futures = set()
+
+    @property
+    def key_limit(self):
+        """Maximum number of tasks with the same key running at once"""
+        return self._key_limit
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) under the given key, returning a Future for the result"""
+        future = Future()
+        task = (future, fn, args, kwargs)
+        with self._lock:
+            self._futures.add(future)
+            if self._running[key] >= self._key_limit:
+                self._pending[key].append(task)
+                return future
+            self._running[key] += 1
+        self._start(key, task)
+        return future
+
+    def shutdown(self, wait_pending=True):
+        """Wait for all submitted tasks, or cancel queued tasks and only wait for running ones"""
+        with self._lock:
+            futures = list(self._futures)
+            queued = [task[0] for tasks in self._pending.values() for task in tasks]
+        if wait_pending:
+            wait(futures)
+        else:
+            for future in queued:
+                future.cancel()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+    def _start(self, key, task):
+        while task is not None:
+            future, fn, args, kwargs = task
+            if future.set_running_or_notify_cancel():
+                inner = self._executor.submit(fn, *args, **kwargs)
+                inner.add_done_callback(lambda done, key=key, future=future: self._complete(key, future, done))
+                return
+            # Cancelled while queued, move on to the next task for the key
+            task = self._release(key, future)
+
+    def _complete(self, key, future, inner):
+        error = inner.exception()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(inner.result())
+        self._start(key, self._release(key, future))
+
+    def _release(self, key, future):
+        """Forget the finished future and hand the key's slot to the next queued task, if any"""
+        with self._lock:
+            self._futures.discard(future)
+            if self._pending[key]:
+                return self._pending[key].popleft()
+            self._running[key] -= 1
+            return None
@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+from email.utils import formatdate
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from utils.http import fetch, get_response_expiry
+from utils.metrics import metrics
+
+__all__ = ['CachedFile']
+
+logger = logging.getLogger('utils.filecache')
+
+# Only used where file locks are unavailable, limiting the single download to this process
+_fallback_lock = threading.Lock()
+
+
+class CachedFile:
+    """Local copy of a remote file, shared by all threads and processes using the same path
+
+    The file is downloaded to a temporary file and published with an atomic rename, so readers
+    never see a partial download. ETag, Last-Modified and expiry are kept in <path>.meta. A lock on
+    <path>.lock ensures a single download; processes that waited for it reuse its result.
+    """
+
+    def __init__(self, path, url, min_ttl=0, chunk_size=1024 * 1024):
+        self.path = path
+        self.url = url
+        self.min_ttl = min_ttl
+        self.chunk_size = chunk_size
+        self.meta_path = path + '.meta'
+        self.lock_path = path + '.lock'
+
+    def meta(self):
+        """Metadata of the current download, empty if there is none"""
+        try:
+            with open(self.meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return {}
+        return meta if meta.get('url') == self.url else {}
+
+    def get(self):
+        """Path of an up to date copy of the file, downloading or revalidating it if needed
+
+        Returns None if there is no copy and it could not be downloaded. Request failures are
+        raised; the previous copy, if any, is left in place.
+        """
+        if self._is_fresh(self.meta()):
+            metrics.inc('file_cache', result='fresh')
+            return self.path
+        waiting = time.time()
+        with self._lock():
+            meta = self.meta()
+            # Another process may have refreshed the file while this one waited for the lock
+            if self._is_fresh(meta) or meta.get('checked', 0) >= waiting:
+                metrics.inc('file_cache', result='shared')
+            else:
+                self._download(meta)
+        return self.path if os.path.exists(self.path) else None
+
+    def _is_fresh(self, meta):
+        if not meta or not os.path.exists(self.path):
+            return False
+        expiry = max(meta.get('expiry') or 0, meta.get('checked', 0) + self.min_ttl)
+        return expiry > time.time()
+
+    def _download(self, meta):
+        headers = {}
+        if meta and os.path.exists(self.path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            headers['If-Modified-Since'] = meta.get('last_modified') or formatdate(os.path.getmtime(self.path), usegmt=True)
+        logger.debug('Checking for latest %s with headers: %s', self.url, headers)
+        # Streamed responses hold their pooled connection until closed, including 304 and error responses
+        with fetch(self.url, stream=True, headers=headers) as r:
+            logger.debug('Response status: %d, Headers: %s', r.status_code, r.headers)
+            r.raise_for_status()
+            if r.status_code == 304:
+                metrics.inc('file_cache', result='revalidated')
+                meta.update(expiry=get_response_expiry(r.headers) or meta.get('expiry'), checked=time.time())
+                meta['etag'] = r.headers.get('ETag', meta.get('etag'))
+            else:
+                metrics.inc('file_cache', result='downloaded')
+                self._write(r)
+                meta = {
+                    'url': self.url,
+                    'etag': r.headers.get('ETag'),
+                    'last_modified': r.headers.get('Last-Modified'),
+                    'expiry': get_response_expiry(r.headers),
+                    'checked': time.time(),
+                }
+        self._write_meta(meta)
+
+    def _write(self, response):
+        directory = os.path.dirname(self.path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    temp_file.write(chunk)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _write_meta(self, meta):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.meta_path) or '.', prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as meta_file:
+                json.dump(meta, meta_file)
+            os.replace(temp_path, self.meta_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @contextmanager
+    def _lock(self):
+        if fcntl is None:
+            with _fallback_lock:
+                yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,103 @@
+import csv
+import json
+import os.path
+
+__all__ = ['FORMATS', 'OUTPUT_FORMATS', 'guess_format', 'read_records', 'record_writer']
+
+FORMATS = ('csv', 'json', 'ndjson')
+OUTPUT_FORMATS = FORMATS + ('table',)
+
+
+def guess_format(fp, default='csv'):
+    """Determine the record format from the file extension"""
+    name = getattr(fp, 'name', '')
+    extension = os.path.splitext(name)[1].lower().lstrip('.') if isinstance(name, str) else ''
+    if extension == 'jsonl':
+        return 'ndjson'
+    return extension if extension in FORMATS else default
+
+
+def read_records(fp, fmt):
+    """Iterate over the records (dicts) in the file
+
+    CSV and NDJSON are read one record at a time, a JSON document must be a list of objects and is
+    loaded at once.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(fp)
+    elif fmt == 'ndjson':
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+    elif fmt == 'json':
+        records = json.load(fp)
+        if not isinstance(records, list):
+            raise ValueError('JSON input must be a list of objects')
+        yield from records
+    else:
+        raise ValueError('Unsupported format {}'.format(fmt))
+
+
+class CsvWriter:
+    def __init__(self, fp, fields):
+        self._writer = csv.DictWriter(fp, fieldnames=fields, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def write(self, record):
+        self._writer.writerow(record)
+
+    def close(self):
+        pass
+
+
+class NdjsonWriter:
+    def __init__(self, fp, fields):
+        self._fp = fp
+
+    def write(self, record):
+        self._fp.write(json.dumps(record, default=str))
+        self._fp.write('\n')
+
+    def close(self):
+        pass
+
+
+class JsonWriter:
+    """Writes records as a JSON list, one element at a time"""
+    def __init__(self, fp, fields):
+        self._fp = fp
+        self._separator = '[\n'
+
+    def write(self, record):
+        self._fp.write(self._separator)
+        self._fp.write(json.dumps(record, default=str))
+        self._separator = ',\n'
+
+    def close(self):
+        self._fp.write('[]\n' if self._separator == '[\n' else '\n]\n')
+
+
+class TableWriter:
+    """Human readable table; records are collected and only written on close to size the columns"""
+    def __init__(self, fp, fields):
+        self._fp = fp
+        self._fields = fields
+        self._rows = []
+
+    def write(self, record):
+        self._rows.append([record.get(field) for field in self._fields])
+
+    def close(self):
+        from tabulate import tabulate
+        self._fp.write(tabulate(self._rows, headers=self._fields))
+        self._fp.write('\n')
+
+
+_writers = {'csv': CsvWriter, 'json': JsonWriter, 'ndjson': NdjsonWriter, 'table': TableWriter}
+
+
+def record_writer(fp, fmt, fields):
+    """Create a writer streaming records (dicts with the given fields) to the file"""
+    if fmt not in _writers:
+        raise ValueError('Unsupported format {}'.format(fmt))
+    return _writers[fmt](fp, fields)
@@ -1,6 +1,212 @@
+from calendar import timegm
 from email.utils import parsedate
+import hashlib
+import json
+import logging
+import os
 import re
+import tempfile
+import threading
 import time
+import urllib.parse
+
+from utils.metrics import metrics
+
+# requests is imported when the first request is made, keeping CLI startup fast for commands that never use it
+
+__all__ = ['configure', 'fetch', 'get_response_expiry', 'HttpClient', 'ResponseCache']
+
+logger = logging.getLogger('utils.http')
+
+
+class ResponseCache:
+    """Disk backed cache of GET responses honouring Cache-Control, Expires, ETag and Last-Modified
+
+    Each entry is a single file holding a JSON metadata line followed by the response body, replaced
+    atomically so concurrent readers never see a partial entry.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def load(self, url):
+        """Return (metadata, body) for the cached URL or None if not cached"""
+        try:
+            with open(self._path(url), 'rb') as entry:
+                meta = json.loads(entry.readline().decode('utf-8'))
+                body = entry.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        return meta, body
+
+    def store(self, url, response, body=None):
+        """Record the response if its headers allow it to be reused or revalidated"""
+        headers = response.headers
+        cache_control = headers.get('Cache-Control', '').lower()
+        if 'no-store' in cache_control:
+            return
+        expiry = None if 'no-cache' in cache_control else get_response_expiry(headers)
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not (expiry or etag or last_modified):
+            return
+        meta = {
+            'url': url,
+            'status': response.status_code,
+            'headers': dict(headers),
+            'encoding': response.encoding,
+            'expiry': expiry,
+            'etag': etag,
+            'last_modified': last_modified,
+        }
+        self._write(url, meta, response.content if body is None else body)
+
+    def refresh(self, url, meta, body, response):
+        """Update a cached entry with the headers of a 304 Not Modified response"""
+        from requests.structures import CaseInsensitiveDict
+        headers = CaseInsensitiveDict(meta['headers'])
+        for name in ('Cache-Control', 'Expires', 'Date', 'ETag', 'Last-Modified'):
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        meta['headers'] = dict(headers)
+        cache_control = headers.get('Cache-Control', '').lower()
+        meta['expiry'] = None if 'no-cache' in cache_control else get_response_expiry(headers)
+        meta['etag'] = headers.get('ETag')
+        meta['last_modified'] = headers.get('Last-Modified')
+        self._write(url, meta, body)
+
+    def _write(self, url, meta, body):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as entry:
+                entry.write(json.dumps(meta).encode('utf-8'))
+                entry.write(b'\n')
+                entry.write(body)
+            os.replace(temp_path, self._path(url))
+        except OSError as e:
+            logger.warning('Failed to cache response for %s: %s', url, e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+class HttpClient:
+    """HTTP client shared by all vendors
+
+    Keeps a pooled keep-alive session per host (bounded to host_connections concurrent connections),
+    retries failed requests with exponential backoff and revalidates cached responses with
+    conditional requests.
+    """
+
+    def __init__(self, cache_dir=None, timeout=30, host_connections=2, retries=3, backoff=0.5):
+        self.timeout = timeout
+        self.host_connections = host_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+
+    def session(self, url):
+        """Get the pooled session for the URL's host"""
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        parts = urllib.parse.urlsplit(url)
+        host = '{}://{}'.format(parts.scheme, parts.netloc)
+        with self._sessions_lock:
+            if host not in self._sessions:
+                retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                    status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+                # pool_block makes callers wait for a free connection rather than exceed the host limit
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.host_connections,
+                    pool_block=True, max_retries=retry)
+                session = requests.Session()
+                session.mount(host, adapter)
+                self._sessions[host] = session
+            return self._sessions[host]
+
+    def get(self, url, **kwargs):
+        """Perform a GET request, answering from or revalidating the response cache when possible
+
+        Streamed requests and requests with caller supplied conditional headers bypass the cache.
+        Responses served from the cache have from_cache set to True.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(kwargs.pop('headers', None) or {})
+        cacheable = self.cache is not None and not kwargs.get('stream') \
+            and 'If-None-Match' not in headers and 'If-Modified-Since' not in headers
+        cached = self.cache.load(url) if cacheable else None
+        if cached:
+            meta, body = cached
+            if meta['expiry'] and meta['expiry'] > time.time():
+                logger.debug('Using cached response for %s', url)
+                metrics.inc('http_cache', host=host, result='hit')
+                return self._cached_response(url, meta, body)
+            if meta['etag']:
+                headers['If-None-Match'] = meta['etag']
+            if meta['last_modified']:
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        with metrics.timer('http_request', host=host):
+            r = self.session(url).get(url, headers=headers, **kwargs)
+        r.from_cache = False
+        metrics.inc('http_responses', host=host, status=r.status_code)
+        # Streamed bodies are not read here, count their announced size instead
+        size = int(r.headers.get('Content-Length') or 0) if kwargs.get('stream') else len(r.content)
+        metrics.inc('http_response_bytes', size, host=host)
+        if cached and r.status_code == 304:
+            logger.debug('Cached response for %s not modified', url)
+            metrics.inc('http_cache', host=host, result='revalidated')
+            self.cache.refresh(url, meta, body, r)
+            return self._cached_response(url, meta, body)
+        if cacheable:
+            metrics.inc('http_cache', host=host, result='miss')
+        if cacheable and r.status_code == 200:
+            self.cache.store(url, r)
+        return r
+
+    def close(self):
+        with self._sessions_lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+    def _cached_response(self, url, meta, body):
+        import requests
+        from requests.structures import CaseInsensitiveDict
+        r = requests.Response()
+        r.url = url
+        r.status_code = meta['status']
+        r.reason = 'OK'
+        r.headers = CaseInsensitiveDict(meta['headers'])
+        r.encoding = meta['encoding']
+        r._content = body
+        r.from_cache = True
+        return r
+
+
+client = HttpClient()
+
+
+def configure(config):
+    """Replace the shared client with one using the homenet configuration"""
+    global client
+    cache_dir = os.path.join(config.cache_dir, 'homenet-http') if config.http_cache else None
+    client.close()
+    client = HttpClient(cache_dir=cache_dir, timeout=config.http_timeout,
+        host_connections=config.host_connections, retries=config.http_retries)
+
+
+def fetch(url, **kwargs):
+    """Perform a GET request through the shared client"""
+    return client.get(url, **kwargs)
 
 
 def get_response_expiry(headers):
@@ -8,13 +214,13 @@ def get_response_expiry(headers):
     expiry = None
     """Use Cache-Control: max-age or Expires to locally track of when the file expires"""
     if 'Cache-Control' in headers and 'max-age=' in headers['Cache-Control']:
-        age = int(re.search('max-age=(\d*)', headers['Cache-Control']).group(1))
+        age = int(re.search(r'max-age=(\d*)', headers['Cache-Control']).group(1))
         if age > 0:
             header_date = parsedate(headers['Date']) if 'Date' in headers else None
-            response_time = time.mktime(header_date) if header_date else time.time()
+            response_time = timegm(header_date) if header_date else time.time()
             expiry = response_time + age
     if not expiry and 'Expires' in headers:
         parsed_expires = parsedate(headers['Expires'])
         if parsed_expires:
-            expiry = time.mktime(parsed_expires)
+            expiry = timegm(parsed_expires)
     return expiry
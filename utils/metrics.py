@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+import json
+import math
+import threading
+import time
+
+__all__ = ['metrics', 'Metrics', 'METRICS_FORMATS']
+
+METRICS_FORMATS = ('table', 'json', 'prometheus')
+
+# Latency buckets in seconds, shared by all histograms
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for position, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[position] += 1
+                break
+
+
+class Metrics:
+    """Thread safe counters and latency histograms (in seconds), identified by name and labels
+
+    Metrics can be reported as a summary table, as JSON or in the Prometheus text exposition format.
+    """
+
+    def __init__(self, prefix='homenet'):
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the block in the name histogram, counting exceptions in name_errors"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(name + '_errors', **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def as_dict(self):
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'min': histogram.min,
+                'max': histogram.max,
+                'buckets': {str(bound): count for bound, count in zip(BUCKETS, histogram.buckets)},
+            } for (name, labels), histogram in sorted(self._histograms.items())]
+        return {'counters': counters, 'histograms': histograms}
+
+    def report(self, fmt):
+        """Render all metrics in one of METRICS_FORMATS"""
+        if fmt == 'json':
+            return json.dumps(self.as_dict(), indent=2)
+        if fmt == 'prometheus':
+            return self._prometheus()
+        if fmt == 'table':
+            return self._table()
+        raise ValueError('Unsupported metrics format {}'.format(fmt))
+
+    def _table(self):
+        from tabulate import tabulate
+        data = self.as_dict()
+        rows = []
+        for histogram in data['histograms']:
+            rows.append({
+                'metric': histogram['name'],
+                'labels': _format_labels(histogram['labels']),
+                'count': histogram['count'],
+                'total (s)': round(histogram['sum'], 4),
+                'mean (s)': round(histogram['sum'] / histogram['count'], 4),
+                'max (s)': round(histogram['max'], 4),
+            })
+        for counter in data['counters']:
+            rows.append({'metric': counter['name'], 'labels': _format_labels(counter['labels']), 'count': counter['value']})
+        return tabulate(rows, headers='keys')
+
+    def _prometheus(self):
+        data = self.as_dict()
+        lines = []
+        declared = set()
+        for counter in data['counters']:
+            name = '{}_{}_total'.format(self.prefix, counter['name'])
+            if name not in declared:
+                lines.append('# TYPE {} counter'.format(name))
+                declared.add(name)
+            lines.append('{}{} {}'.format(name, _prometheus_labels(counter['labels']), counter['value']))
+        for histogram in data['histograms']:
+            name = '{}_{}_seconds'.format(self.prefix, histogram['name'])
+            if name not in declared:
+                lines.append('# TYPE {} histogram'.format(name))
+                declared.add(name)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram['buckets'].values()):
+                cumulative += count
+                le = '+Inf' if bound == math.inf else repr(bound)
+                lines.append('{}_bucket{} {}'.format(name, _prometheus_labels(dict(histogram['labels'], le=le)), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _prometheus_labels(histogram['labels']), histogram['sum']))
+            lines.append('{}_count{} {}'.format(name, _prometheus_labels(histogram['labels']), histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    return ','.join('{}={}'.format(key, value) for key, value in labels.items())
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+metrics = Metrics()
@@ -0,0 +1,60 @@
+import re
+
+__all__ = ['version_key']
+
+_EPOCH = re.compile('^([0-9]+):(.+)$')
+_TOKEN = re.compile('([a-zA-Z]+)|([0-9]+)')
+
+
+def _length(length):
+    """Encode a length so that longer sorts after shorter, with no limit (9 prefixes the length of the length)"""
+    if length < 9:
+        return str(length)
+    return '9' + _length(len(str(length))) + str(length)
+
+
+def _number(digits):
+    """Encode a number so longer numbers sort after shorter ones"""
+    digits = digits.lstrip('0')
+    return _length(len(digits)) + digits
+
+
+def _block(block):
+    try:
+        # cmp_version compares blocks int() accepts, such as Netgear's "68_60", as a single number
+        return _number(str(int(block)))
+    except ValueError:
+        pass
+    tokens = _TOKEN.findall(block)
+    return ''.join(alpha.lower() if alpha else _number(number) for alpha, number in tokens)
+
+
+def _part(part):
+    blocks = [_block(block) for block in part.split('.')]
+    # 1.1 is the same version as 1.1.0
+    while blocks and blocks[-1] in ('', '0'):
+        blocks.pop()
+    return '.'.join(blocks)
+
+
+def version_key(version):
+    """Normalized form of a version string that sorts (byte-wise) the same way cmp_version compares
+
+    Dot separated blocks are compared left to right, numbers numerically and letters after numbers;
+    release parts after a "-" and an "<epoch>:" prefix are supported. Returns None for None.
+    cmp_version reads a block such as "68_60" as the number 6860 when compared with another number,
+    but as 68 and 60 when compared with a block containing letters; keys use the former.
+    """
+    if version is None:
+        return None
+    epoch = '0'
+    match = _EPOCH.match(version)
+    if match:
+        epoch, version = match.groups()
+    parts = [_part(part) for part in version.split('-')]
+    while parts and parts[-1] == '':
+        parts.pop()
+    key = '-'.join(parts)
+    epoch = _number(epoch)
+    # "~" sorts after letters and digits, placing versions with an epoch after all versions without
+    return key if epoch == '0' else '~{}:{}'.format(epoch, key)